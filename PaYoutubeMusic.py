@@ -1,33 +1,104 @@
+from itertools import islice
+from requests.adapters import HTTPAdapter
 from ytmusicapi import YTMusic
-import csv
+from ytmusicapi.exceptions import YTMusicServerError
+import asyncio
+import pandas as pd
+import random
+import requests
+import shelve
+import time
 
-ytmusic = YTMusic('browser.json')
+MAX_BUSQUEDAS = 8  # Búsquedas simultáneas
+TAMANO_LOTE = 100  # Vídeos por llamada a add_playlist_items
+INTERVALO_PETICIONES = 0.1  # Segundos entre búsquedas para no saturar la API
+MAX_REINTENTOS = 5
+
+# Sesión compartida: los hilos reutilizan conexiones TLS en lugar de abrir una por petición
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+ytmusic = YTMusic('browser.json', requests_session=session)
 
 nombre_lista = "Techno"
 id_lista = ytmusic.create_playlist(nombre_lista, "Importada desde Spotify")
 
-with open('csv.csv', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    next(reader)
-    for row in reader:
-    
-        titulo = row[1]
-        artista = row[3]
-        consulta_busqueda = f"{titulo} {artista}"
-        resultados_busqueda = ytmusic.search(consulta_busqueda, filter="songs")
+# Columnas 1 (título) y 3 (artista) del CSV exportado de Spotify
+df = pd.read_csv('csv.csv', encoding='utf-8', usecols=[1, 3], header=0,
+                 dtype=str, engine='c', na_filter=False)
+df.columns = ['titulo', 'artista']
+
+# Preprocesado vectorizado: consulta, título en minúsculas y clave de caché
+df['consulta'] = df['titulo'] + ' ' + df['artista']
+df['titulo_lc'] = df['titulo'].str.lower()
+df['clave'] = (df['titulo'] + '|' + df['artista']).str.lower()
+# Las filas repetidas solo se buscan una vez
+df = df.drop_duplicates('clave')
+canciones = list(df[['consulta', 'titulo_lc', 'clave']].itertuples(index=False, name=None))
+
+
+async def buscar(consulta, limite):
+    async with limite:
+        # ytmusicapi es síncrono: cada búsqueda se delega a un hilo y el
+        # semáforo acota cuántas hay en vuelo a la vez
+        resultados = await asyncio.to_thread(ytmusic.search, consulta, filter="songs", limit=5)
+        await asyncio.sleep(INTERVALO_PETICIONES)
+        return resultados
+
+
+async def buscar_todas(consultas):
+    limite = asyncio.Semaphore(MAX_BUSQUEDAS)
+    return await asyncio.gather(*(buscar(consulta, limite) for consulta in consultas))
+
+
+# Caché en disco de búsquedas: una ejecución repetida no vuelve a consultar la API
+with shelve.open('ytm_search_cache.db') as cache:
+    pendientes = [consulta for consulta, _, clave in canciones if clave not in cache]
+    resultados = iter(asyncio.run(buscar_todas(pendientes)))
+
+    video_ids = []
+    for consulta, titulo_lc, clave in canciones:
+        if clave in cache:
+            video_ids.append(cache[clave])
+            continue
+
+        resultados_busqueda = next(resultados)
         id_video_seleccionado = None
         if resultados_busqueda:
             for result in resultados_busqueda:
-                if titulo.lower() in result.get('title', '').lower():
+                if titulo_lc in result.get('title', '').lower():
                     id_video_seleccionado = result['videoId']
                     break
-            
+
             if not id_video_seleccionado:
                 id_video_seleccionado = resultados_busqueda[0]['videoId']
-            try:
-                ytmusic.add_playlist_items(id_lista, [id_video_seleccionado])
-            except Exception as error:
-                if "HTTP 409" in str(error):
-                    print(f"Ignorando duplicado: {titulo}")
-                else:
-                    raise error
\ No newline at end of file
+            cache[clave] = id_video_seleccionado
+            video_ids.append(id_video_seleccionado)
+
+
+def agregar(ids):
+    """Añade un lote con reintentos exponenciales; ante un 409 lo divide para aislar los duplicados"""
+    for intento in range(MAX_REINTENTOS):
+        try:
+            ytmusic.add_playlist_items(id_lista, ids)
+            return
+        except YTMusicServerError as error:
+            # ytmusicapi no expone el código HTTP: viene al inicio del mensaje
+            if error.args and str(error.args[0]).startswith("Server returned HTTP 409"):
+                if len(ids) == 1:
+                    print(f"Ignorando duplicado: {ids[0]}")
+                    return
+                mitad = len(ids) // 2
+                agregar(ids[:mitad])
+                agregar(ids[mitad:])
+                return
+            if intento == MAX_REINTENTOS - 1:
+                raise
+            # Espera exponencial con jitter para errores transitorios (5xx, 429)
+            time.sleep(min(2 ** intento, 30) + random.uniform(0, 1))
+
+
+# Se eliminan los duplicados locales antes de enviar los lotes
+video_ids = iter(dict.fromkeys(video_ids))
+while lote := list(islice(video_ids, TAMANO_LOTE)):
+    agregar(lote)
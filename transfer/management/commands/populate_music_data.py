@@ -2,6 +2,7 @@
 Script para poblar la base de datos con plataformas musicales iniciales
 """
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from transfer.models import MusicPlatform, Genre
 
 
@@ -79,18 +80,6 @@ class Command(BaseCommand):
             }
         ]
         
-        for platform_data in platforms:
-            platform, created = MusicPlatform.objects.get_or_create(
-                name=platform_data['name'],
-                defaults=platform_data
-            )
-            if created:
-                self.stdout.write(f'✅ Creada plataforma: {platform.display_name}')
-            else:
-                self.stdout.write(f'⚪ Ya existe: {platform.display_name}')
-        
-        self.stdout.write('\nCreando géneros musicales...')
-        
         # Géneros musicales principales
         genres = [
             {'name': 'Pop', 'color': '#FF6B6B'},
@@ -115,16 +104,36 @@ class Command(BaseCommand):
             {'name': 'Ambient', 'color': '#81ECEC'},
         ]
         
-        for genre_data in genres:
-            genre, created = Genre.objects.get_or_create(
-                name=genre_data['name'],
-                defaults=genre_data
+        existing_platforms = set(MusicPlatform.objects.values_list('name', flat=True))
+        existing_genres = set(Genre.objects.values_list('name', flat=True))
+        
+        with transaction.atomic():
+            MusicPlatform.objects.bulk_create(
+                [MusicPlatform(**platform_data) for platform_data in platforms],
+                ignore_conflicts=True,
+                batch_size=500
             )
-            if created:
-                self.stdout.write(f'✅ Creado género: {genre.name}')
-            else:
-                self.stdout.write(f'⚪ Ya existe: {genre.name}')
+            Genre.objects.bulk_create(
+                [Genre(**genre_data) for genre_data in genres],
+                ignore_conflicts=True,
+                batch_size=500
+            )
+        
+        created_platforms = [p['display_name'] for p in platforms if p['name'] not in existing_platforms]
+        skipped_platforms = [p['display_name'] for p in platforms if p['name'] in existing_platforms]
+        if created_platforms:
+            self.stdout.write(f'✅ Creadas plataformas: {", ".join(created_platforms)}')
+        if skipped_platforms:
+            self.stdout.write(f'⚪ Ya existen: {", ".join(skipped_platforms)}')
+        
+        self.stdout.write('\nCreando géneros musicales...')
+        created_genres = [g['name'] for g in genres if g['name'] not in existing_genres]
+        skipped_genres = [g['name'] for g in genres if g['name'] in existing_genres]
+        if created_genres:
+            self.stdout.write(f'✅ Creados géneros: {", ".join(created_genres)}')
+        if skipped_genres:
+            self.stdout.write(f'⚪ Ya existen: {", ".join(skipped_genres)}')
         
         self.stdout.write(self.style.SUCCESS('\n🎵 ¡Base de datos poblada exitosamente!'))
-        self.stdout.write(f'Plataformas activas: {MusicPlatform.objects.filter(is_active=True).count()}')
-        self.stdout.write(f'Géneros disponibles: {Genre.objects.count()}')
+        self.stdout.write(f'Plataformas activas: {sum(1 for p in platforms if p.get("is_active", True))}')
+        self.stdout.write(f'Géneros disponibles: {len(genres)}')
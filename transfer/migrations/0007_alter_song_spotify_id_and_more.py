@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfer', '0006_artist_musicplatform_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='song',
+            name='spotify_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['requester', 'status'], name='transfer_fr_request_2672dd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['addressee', 'status'], name='transfer_fr_address_9fa0e2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='musiccompatibility',
+            index=models.Index(fields=['-overall_compatibility'], name='transfer_mu_overall_824cc8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlisteningstats',
+            index=models.Index(fields=['user', 'platform_connection', 'period_type'], name='transfer_us_user_id_57cc75_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlisteningstats',
+            index=models.Index(fields=['-period_end'], name='transfer_us_period__1a2462_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermusicconnection',
+            index=models.Index(fields=['user', 'is_active'], name='transfer_us_user_id_5b19fa_idx'),
+        ),
+    ]
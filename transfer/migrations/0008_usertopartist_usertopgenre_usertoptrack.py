@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfer', '0007_alter_song_spotify_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTopArtist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minutes', models.IntegerField(default=0)),
+                ('plays', models.IntegerField(default=0)),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_in_stats', to='transfer.artist')),
+                ('stats', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_artists_rel', to='transfer.userlisteningstats')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['artist', '-minutes'], name='transfer_us_artist__0955ff_idx')],
+                'unique_together': {('stats', 'artist')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UserTopGenre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minutes', models.IntegerField(default=0)),
+                ('percentage', models.FloatField(default=0.0)),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_in_stats', to='transfer.genre')),
+                ('stats', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_genres_rel', to='transfer.userlisteningstats')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['genre', '-minutes'], name='transfer_us_genre_i_b6ae96_idx')],
+                'unique_together': {('stats', 'genre')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UserTopTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minutes', models.IntegerField(default=0)),
+                ('plays', models.IntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_in_stats', to='transfer.song')),
+                ('stats', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_tracks_rel', to='transfer.userlisteningstats')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['song', '-minutes'], name='transfer_us_song_id_2aa712_idx')],
+                'unique_together': {('stats', 'song')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfer', '0008_usertopartist_usertopgenre_usertoptrack'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usermusicconnection',
+            name='token_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='usermusicconnection',
+            index=models.Index(fields=['platform', 'platform_user_id'], name='transfer_us_platfor_0bfbe8_idx'),
+        ),
+    ]
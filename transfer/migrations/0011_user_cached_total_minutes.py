@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:26
+
+from django.db import migrations, models
+
+
+def backfill_cached_total_minutes(apps, schema_editor):
+    User = apps.get_model('transfer', 'User')
+    for user in User.objects.annotate(total=models.Sum('listening_stats__total_minutes')).filter(total__gt=0):
+        User.objects.filter(pk=user.pk).update(cached_total_minutes=user.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfer', '0009_alter_usermusicconnection_token_expires_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='cached_total_minutes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_cached_total_minutes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-15 22:40
+
+import orjson
+from django.db import migrations, models
+
+
+def backfill_top_minutes_bin(apps, schema_editor):
+    UserListeningStats = apps.get_model('transfer', 'UserListeningStats')
+    for stats in UserListeningStats.objects.only('top_artists', 'top_genres').iterator():
+        UserListeningStats.objects.filter(pk=stats.pk).update(
+            top_artists_bin=orjson.dumps({a['name']: a.get('minutes', 0) for a in stats.top_artists if a.get('name')}),
+            top_genres_bin=orjson.dumps({g['name']: g.get('minutes', 0) for g in stats.top_genres if g.get('name')}),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfer', '0011_user_cached_total_minutes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userlisteningstats',
+            name='top_artists_bin',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.AddField(
+            model_name='userlisteningstats',
+            name='top_genres_bin',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.RunPython(backfill_top_minutes_bin, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
+import orjson
 
 
 class User(AbstractUser):
@@ -29,6 +30,9 @@ class User(AbstractUser):
     last_music_sync = models.DateTimeField(blank=True, null=True)
     last_active = models.DateTimeField(auto_now=True)
     
+    # Desnormalizado: suma de total_minutes de listening_stats
+    cached_total_minutes = models.BigIntegerField(default=0)
+    
     def __str__(self):
         return self.username
     
@@ -39,16 +43,26 @@ class User(AbstractUser):
     @property
     def connected_platforms(self):
         """Retorna lista de plataformas conectadas"""
-        platforms = []
-        connections = self.music_connections.all()
-        return [conn.platform for conn in connections if conn.is_active]
+        connections = self.music_connections.select_related('platform').filter(is_active=True)
+        return [conn.platform for conn in connections]
     
     @property
     def total_listening_minutes(self):
         """Total de minutos escuchados en todas las plataformas"""
-        return self.listening_stats.aggregate(
-            total=models.Sum('total_minutes')
-        )['total'] or 0
+        return self.cached_total_minutes
+    
+    def mark_music_synced(self):
+        """Registra una sincronización (invalida las estadísticas unificadas cacheadas)"""
+        self.last_music_sync = timezone.now()
+        User.objects.filter(pk=self.pk).update(last_music_sync=self.last_music_sync)
+    
+    def add_listening_minutes(self, delta):
+        """Ajusta el total cacheado de minutos con un UPDATE atómico"""
+        if delta:
+            User.objects.filter(pk=self.pk).update(
+                cached_total_minutes=models.F('cached_total_minutes') + delta
+            )
+            self.cached_total_minutes += delta
 
 
 class MusicPlatform(models.Model):
@@ -89,7 +103,7 @@ class UserMusicConnection(models.Model):
     platform_username = models.CharField(max_length=200, blank=True)
     access_token = models.TextField(blank=True, null=True)
     refresh_token = models.TextField(blank=True, null=True)
-    token_expires_at = models.DateTimeField(blank=True, null=True)
+    token_expires_at = models.DateTimeField(blank=True, null=True, db_index=True)
     
     # Datos del perfil de la plataforma
     profile_data = models.JSONField(default=dict)  # Datos específicos de cada plataforma
@@ -109,6 +123,10 @@ class UserMusicConnection(models.Model):
     class Meta:
         unique_together = ['user', 'platform']
         ordering = ['-connected_at']
+        indexes = [
+            models.Index(fields=['platform', 'platform_user_id']),
+            models.Index(fields=['user', 'is_active']),
+        ]
 
 
 class Artist(models.Model):
@@ -180,6 +198,8 @@ class UserListeningStats(models.Model):
     top_artists = models.JSONField(default=list)  # [{"name": "Artist", "minutes": 120, "plays": 45}]
     top_genres = models.JSONField(default=list)
     top_tracks = models.JSONField(default=list)
+    top_artists_bin = models.BinaryField(blank=True, default=b'')  # {nombre: minutos} serializado con orjson
+    top_genres_bin = models.BinaryField(blank=True, default=b'')
     
     # Patrones de escucha
     listening_patterns = models.JSONField(default=dict)  # Por hora del día, día de semana, etc.
@@ -190,9 +210,151 @@ class UserListeningStats(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.platform_connection.platform.display_name} - {self.period_type}"
     
+    @staticmethod
+    def top_minutes(items):
+        """{nombre: minutos} de una lista de top"""
+        return {item['name']: item.get('minutes', 0) for item in items if item.get('name')}
+    
+    @staticmethod
+    def pack_top_minutes(items):
+        """Serializa {nombre: minutos} de una lista de top con orjson"""
+        return orjson.dumps(UserListeningStats.top_minutes(items))
+    
+    @property
+    def artist_minutes(self):
+        """Minutos por artista, listos para sumar en un Counter"""
+        if self.top_artists_bin:
+            return orjson.loads(bytes(self.top_artists_bin))
+        return self.top_minutes(self.top_artists)
+    
+    @property
+    def genre_minutes(self):
+        """Minutos por género, listos para sumar en un Counter"""
+        if self.top_genres_bin:
+            return orjson.loads(bytes(self.top_genres_bin))
+        return self.top_minutes(self.top_genres)
+    
+    def refresh_top_items(self):
+        """Regenera las tablas normalizadas de tops a partir de los campos JSON"""
+        artists = {a['spotify_id']: a for a in self.top_artists if a.get('spotify_id')}
+        genres = {g['name']: g for g in self.top_genres if g.get('name')}
+        tracks = {(t['name'], t['artist']): t for t in self.top_tracks if t.get('name') and t.get('artist')}
+        
+        with transaction.atomic():
+            self.top_artists_rel.all().delete()
+            self.top_genres_rel.all().delete()
+            self.top_tracks_rel.all().delete()
+            
+            # Artistas (identificados por su ID de Spotify)
+            Artist.objects.bulk_create(
+                [Artist(name=a['name'], spotify_id=spotify_id) for spotify_id, a in artists.items()],
+                ignore_conflicts=True
+            )
+            artist_map = Artist.objects.in_bulk(list(artists), field_name='spotify_id')
+            UserTopArtist.objects.bulk_create([
+                UserTopArtist(
+                    stats=self,
+                    artist=artist_map[spotify_id],
+                    minutes=a.get('minutes', 0),
+                    plays=a.get('plays', 0)
+                )
+                for spotify_id, a in artists.items() if spotify_id in artist_map
+            ])
+            
+            # Géneros
+            Genre.objects.bulk_create([Genre(name=name) for name in genres], ignore_conflicts=True)
+            genre_map = Genre.objects.in_bulk(list(genres), field_name='name')
+            UserTopGenre.objects.bulk_create([
+                UserTopGenre(
+                    stats=self,
+                    genre=genre_map[name],
+                    minutes=g.get('minutes', 0),
+                    percentage=g.get('percentage', 0.0)
+                )
+                for name, g in genres.items() if name in genre_map
+            ])
+            
+            # Canciones (name + artist es la clave única de Song)
+            Song.objects.bulk_create(
+                [Song(name=name, artist=artist, spotify_id=t.get('spotify_id') or '')
+                 for (name, artist), t in tracks.items()],
+                ignore_conflicts=True
+            )
+            song_map = {
+                (song.name, song.artist): song
+                for song in Song.objects.filter(
+                    name__in=[name for name, _ in tracks],
+                    artist__in=[artist for _, artist in tracks]
+                )
+            }
+            UserTopTrack.objects.bulk_create([
+                UserTopTrack(
+                    stats=self,
+                    song=song_map[key],
+                    minutes=t.get('minutes', 0),
+                    plays=t.get('plays', 0)
+                )
+                for key, t in tracks.items() if key in song_map
+            ])
+    
     class Meta:
         unique_together = ['user', 'platform_connection', 'period_type', 'period_start']
         ordering = ['-period_end']
+        indexes = [
+            models.Index(fields=['user', 'platform_connection', 'period_type']),
+            models.Index(fields=['-period_end']),
+        ]
+
+
+class UserTopArtist(models.Model):
+    """Artista del top de unas estadísticas (tabla normalizada de top_artists)"""
+    stats = models.ForeignKey(UserListeningStats, on_delete=models.CASCADE, related_name='top_artists_rel')
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name='top_in_stats')
+    minutes = models.IntegerField(default=0)
+    plays = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.artist.name} ({self.minutes} min)"
+    
+    class Meta:
+        unique_together = ['stats', 'artist']
+        indexes = [
+            models.Index(fields=['artist', '-minutes']),
+        ]
+
+
+class UserTopGenre(models.Model):
+    """Género del top de unas estadísticas (tabla normalizada de top_genres)"""
+    stats = models.ForeignKey(UserListeningStats, on_delete=models.CASCADE, related_name='top_genres_rel')
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, related_name='top_in_stats')
+    minutes = models.IntegerField(default=0)
+    percentage = models.FloatField(default=0.0)
+    
+    def __str__(self):
+        return f"{self.genre.name} ({self.minutes} min)"
+    
+    class Meta:
+        unique_together = ['stats', 'genre']
+        indexes = [
+            models.Index(fields=['genre', '-minutes']),
+        ]
+
+
+class UserTopTrack(models.Model):
+    """Canción del top de unas estadísticas (tabla normalizada de top_tracks)"""
+    stats = models.ForeignKey(UserListeningStats, on_delete=models.CASCADE, related_name='top_tracks_rel')
+    song = models.ForeignKey('Song', on_delete=models.CASCADE, related_name='top_in_stats')
+    minutes = models.IntegerField(default=0)
+    plays = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.song.name} ({self.minutes} min)"
+    
+    class Meta:
+        unique_together = ['stats', 'song']
+        indexes = [
+            models.Index(fields=['song', '-minutes']),
+        ]
 
 
 class Friendship(models.Model):
@@ -216,6 +378,10 @@ class Friendship(models.Model):
     class Meta:
         unique_together = ['requester', 'addressee']
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['requester', 'status']),
+            models.Index(fields=['addressee', 'status']),
+        ]
 
 
 class MusicCompatibility(models.Model):
@@ -242,10 +408,16 @@ class MusicCompatibility(models.Model):
     class Meta:
         unique_together = ['user1', 'user2']
         ordering = ['-overall_compatibility']
+        indexes = [
+            models.Index(fields=['-overall_compatibility']),
+        ]
 
 
 # === MODELOS LEGACY (mantenidos para compatibilidad) ===
 
+SPOTIFY_PLAYLIST_URL = 'https://open.spotify.com/playlist/'
+YOUTUBE_PLAYLIST_URL = 'https://music.youtube.com/playlist?list='
+
 class Playlist(models.Model):
     """Modelo legacy para playlists - mantenido para compatibilidad"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -262,12 +434,12 @@ class Playlist(models.Model):
     
     @property
     def spotify_url(self):
-        return f"https://open.spotify.com/playlist/{self.spotify_id}"
+        return SPOTIFY_PLAYLIST_URL + self.spotify_id
     
     @property 
     def youtube_url(self):
         if self.youtube_playlist_id:
-            return f"https://music.youtube.com/playlist?list={self.youtube_playlist_id}"
+            return YOUTUBE_PLAYLIST_URL + self.youtube_playlist_id
         return None
     
     class Meta:
@@ -279,7 +451,7 @@ class Song(models.Model):
     name = models.CharField(max_length=300)
     artist = models.CharField(max_length=300)
     album = models.CharField(max_length=300, blank=True)
-    spotify_id = models.CharField(max_length=100, blank=True)
+    spotify_id = models.CharField(max_length=100, blank=True, db_index=True)
     youtube_video_id = models.CharField(max_length=50, blank=True)
     duration_ms = models.IntegerField(null=True, blank=True)
     preview_url = models.URLField(blank=True, null=True)
@@ -309,6 +481,20 @@ class PlaylistSong(models.Model):
         ordering = ['position']
 
 
+class TransferJobManager(models.Manager):
+    """Carga playlist y usuario junto al trabajo (usados en __str__ y listados)"""
+    
+    def get_queryset(self):
+        return super().get_queryset().select_related('playlist', 'user')
+
+
+class SongTransferResultManager(models.Manager):
+    """Carga canción y trabajo junto al resultado (usados en __str__ y listados)"""
+    
+    def get_queryset(self):
+        return super().get_queryset().select_related('song', 'transfer_job')
+
+
 class TransferJob(models.Model):
     """Modelo legacy para trabajos de transferencia"""
     STATUS_CHOICES = [
@@ -341,6 +527,8 @@ class TransferJob(models.Model):
     error_message = models.TextField(blank=True)
     notes = models.TextField(blank=True)
     
+    objects = TransferJobManager()
+    
     def __str__(self):
         return f"Transferencia de '{self.playlist.name}' - {self.status}"
     
@@ -383,6 +571,8 @@ class SongTransferResult(models.Model):
     error_message = models.TextField(blank=True, null=True)
     processed_at = models.DateTimeField(auto_now_add=True)
     
+    objects = SongTransferResultManager()
+    
     def __str__(self):
         return f"{self.song.name} - {self.transfer_status}"
     
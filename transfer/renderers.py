@@ -0,0 +1,22 @@
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class OrjsonRenderer(BaseRenderer):
+    """Renderer JSON basado en orjson: serializa directamente a bytes UTF-8"""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    
+    # Tipos que orjson no conoce (Decimal, timedelta, lazy strings...) usan el encoder de DRF
+    _fallback = JSONEncoder().default
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(
+            data,
+            default=self._fallback,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+        )
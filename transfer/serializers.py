@@ -1,14 +1,32 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
 from .models import Playlist, Song, TransferJob, PlaylistSong, SongTransferResult
 
 User = get_user_model()
 
+# Columnas que necesitan los serializers de listado (para .only())
+USER_SUMMARY_FIELDS = ['id', 'username', 'email', 'first_name', 'last_name']
+PLAYLIST_SUMMARY_FIELDS = [
+    'id', 'spotify_id', 'youtube_playlist_id', 'name', 'description', 'total_tracks',
+    'created_at', 'updated_at', 'user'
+]
+
+
+def _related_fields(prefix, fields):
+    return [f'{prefix}__{field}' for field in fields]
+
+
+def _model_columns(model, fields):
+    """Solo los campos que son columnas reales del modelo (descarta propiedades y campos declarados)"""
+    columns = {field.name for field in model._meta.concrete_fields}
+    return [field for field in fields if field in columns]
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'first_name', 'last_name']
+        fields = USER_SUMMARY_FIELDS
 
 
 class SongSerializer(serializers.ModelSerializer):
@@ -21,6 +39,16 @@ class SongSerializer(serializers.ModelSerializer):
             'spotify_id', 'youtube_video_id', 'duration_ms', 
             'preview_url', 'spotify_url'
         ]
+    
+    def to_representation(self, instance):
+        # Una misma canción puede aparecer varias veces en una respuesta anidada:
+        # se serializa una sola vez por petición
+        if instance.pk is None:
+            return super().to_representation(instance)
+        cache = self.context.setdefault('_song_repr_cache', {})
+        if instance.pk not in cache:
+            cache[instance.pk] = super().to_representation(instance)
+        return cache[instance.pk]
 
 
 class PlaylistSongSerializer(serializers.ModelSerializer):
@@ -44,6 +72,16 @@ class PlaylistSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'user', 'songs', 'spotify_url', 'youtube_url'
         ]
         read_only_fields = ['created_at', 'updated_at']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Precarga usuario y canciones para evitar consultas N+1"""
+        return queryset.select_related('user').prefetch_related(
+            Prefetch(
+                'playlistsong_set',
+                queryset=PlaylistSong.objects.select_related('song').order_by('position')
+            )
+        )
 
 
 class PlaylistListSerializer(serializers.ModelSerializer):
@@ -59,6 +97,14 @@ class PlaylistListSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'user', 'spotify_url', 'youtube_url'
         ]
         read_only_fields = ['created_at', 'updated_at']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Precarga el usuario (sin canciones) cargando solo las columnas serializadas"""
+        return queryset.select_related('user').only(
+            *PLAYLIST_SUMMARY_FIELDS,
+            *_related_fields('user', USER_SUMMARY_FIELDS)
+        )
 
 
 class SongTransferResultSerializer(serializers.ModelSerializer):
@@ -91,6 +137,13 @@ class TransferJobSerializer(serializers.ModelSerializer):
             'created_at', 'started_at', 'completed_at', 'total_songs',
             'processed_songs', 'successful_transfers', 'failed_transfers'
         ]
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Precarga usuario, playlist y resultados con su canción"""
+        return queryset.select_related('user', 'playlist__user').prefetch_related(
+            Prefetch('song_results', queryset=SongTransferResult.objects.select_related('song'))
+        )
 
 
 class TransferJobListSerializer(serializers.ModelSerializer):
@@ -107,6 +160,16 @@ class TransferJobListSerializer(serializers.ModelSerializer):
             'successful_transfers', 'failed_transfers', 'progress_percentage',
             'created_at', 'started_at', 'completed_at', 'error_message'
         ]
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Precarga usuario y playlist (sin resultados) cargando solo las columnas serializadas"""
+        return queryset.select_related('user', 'playlist__user').only(
+            *_model_columns(TransferJob, TransferJobListSerializer.Meta.fields),
+            *_related_fields('user', USER_SUMMARY_FIELDS),
+            *_related_fields('playlist', PLAYLIST_SUMMARY_FIELDS),
+            *_related_fields('playlist__user', USER_SUMMARY_FIELDS)
+        )
 
 
 class TransferJobCreateSerializer(serializers.Serializer):
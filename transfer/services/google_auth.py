@@ -4,8 +4,13 @@ Servicio de autenticación OAuth de Google para YouTube Music
 import os
 import json
 import logging
+import threading
 from datetime import datetime, timedelta
+from functools import lru_cache
 from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
 from django.utils import timezone
 from google.auth.transport.requests import Request
@@ -16,6 +21,39 @@ from googleapiclient.errors import HttpError
 
 logger = logging.getLogger(__name__)
 
+DUPLICATE_VIDEO_MESSAGE = "El video ya está en la playlist"
+
+
+def _is_duplicate(error):
+    """Un 409 de la API indica que el video ya estaba en la playlist"""
+    return isinstance(error, HttpError) and error.resp.status == 409
+
+
+# Sesión compartida para las llamadas a los endpoints OAuth (keep-alive + reintentos)
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=frozenset(['GET', 'POST'])
+    )
+))
+
+
+@lru_cache(maxsize=256)
+def _build_youtube(access_token, thread_id):
+    """Construye (una vez) el cliente de YouTube API para un token"""
+    # httplib2 no es thread-safe, por eso el hilo forma parte de la clave
+    return build(
+        'youtube', 'v3',
+        credentials=Credentials(token=access_token),
+        static_discovery=True,
+        cache_discovery=False
+    )
+
 
 class GoogleOAuthService:
     """Servicio para manejar autenticación OAuth de Google/YouTube"""
@@ -110,7 +148,8 @@ class GoogleOAuthService:
         """Obtiene información del usuario desde Google"""
         try:
             # Crear servicio de OAuth2 para obtener info del usuario
-            oauth2_service = build('oauth2', 'v2', credentials=credentials)
+            # Documento de discovery empaquetado con la librería: sin petición HTTP
+            oauth2_service = build('oauth2', 'v2', credentials=credentials, static_discovery=True, cache_discovery=False)
             user_info = oauth2_service.userinfo().get().execute()
             
             return {
@@ -137,7 +176,7 @@ class GoogleOAuthService:
             )
             
             # Refrescar token
-            credentials.refresh(Request())
+            credentials.refresh(Request(session=_SESSION))
             
             return {
                 'access_token': credentials.token,
@@ -151,9 +190,11 @@ class GoogleOAuthService:
     def revoke_access(self, token):
         """Revoca el acceso del token"""
         try:
-            import requests
-            revoke_url = f"https://oauth2.googleapis.com/revoke?token={token}"
-            response = requests.post(revoke_url)
+            response = _SESSION.post(
+                'https://oauth2.googleapis.com/revoke',
+                data={'token': token},
+                timeout=5
+            )
             return response.status_code == 200
             
         except Exception as e:
@@ -163,9 +204,7 @@ class GoogleOAuthService:
     def get_youtube_service(self, access_token):
         """Crea un servicio de YouTube API con el token de acceso"""
         try:
-            credentials = Credentials(token=access_token)
-            youtube_service = build('youtube', 'v3', credentials=credentials)
-            return youtube_service
+            return _build_youtube(access_token, threading.get_ident())
             
         except Exception as e:
             logger.error(f"Error creating YouTube service: {e}")
@@ -312,6 +351,9 @@ class YouTubeMusicService:
             return True, None
             
         except HttpError as e:
+            if _is_duplicate(e):
+                logger.info(f"Video {video_id} already in playlist {playlist_id}")
+                return True, DUPLICATE_VIDEO_MESSAGE
             error_msg = f"Error adding video to playlist: {e}"
             logger.error(error_msg)
             return False, error_msg
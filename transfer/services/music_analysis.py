@@ -2,19 +2,43 @@
 Servicio para análisis musical multiplataforma
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Prefetch, Q
 from django.utils import timezone
 from collections import defaultdict, Counter
+import bisect
+import heapq
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Segundos que se reutilizan las estadísticas unificadas entre peticiones
+UNIFIED_STATS_TIMEOUT = 300
+
+# Amigos cuyas estadísticas se cargan en paralelo al generar recomendaciones
+FRIEND_STATS_WORKERS = 5
+
+# Umbrales de compatibilidad (ordenados) y el nivel de cada tramo
+COMPATIBILITY_THRESHOLDS = (20, 35, 50, 65, 80)
+COMPATIBILITY_LEVELS = (
+    {'level': 'Mundos Aparte', 'emoji': '🌍', 'color': '#636E72'},
+    {'level': 'Diferente Onda', 'emoji': '🎤', 'color': '#E17055'},
+    {'level': 'Algo en Común', 'emoji': '🎸', 'color': '#F9CA24'},
+    {'level': 'Compatible', 'emoji': '🎶', 'color': '#45B7D1'},
+    {'level': 'Muy Compatible', 'emoji': '🎵', 'color': '#4ECDC4'},
+    {'level': 'Gemelos Musicales', 'emoji': '🎭', 'color': '#FF6B6B'},
+)
+
 
 class MusicAnalysisService:
     """Servicio para análisis de datos musicales unificados"""
     
     def __init__(self, user):
         self.user = user
+        self._stats_cache = {}
     
     def get_user_connections(self):
         """Obtiene todas las conexiones activas del usuario"""
@@ -22,7 +46,29 @@ class MusicAnalysisService:
     
     def get_unified_stats(self, period='monthly'):
         """Obtiene estadísticas unificadas de todas las plataformas"""
-        connections = self.get_user_connections()
+        # Memoizadas en la instancia y en la caché de Django; la clave incluye
+        # la fecha de la última sincronización, que cambia al escribir estadísticas
+        if period not in self._stats_cache:
+            last_sync = self.user.last_music_sync
+            cache_key = f"unified_stats:{self.user.pk}:{period}:{last_sync.timestamp() if last_sync else 0}"
+            self._stats_cache[period] = cache.get_or_set(
+                cache_key, lambda: self._build_unified_stats(period), UNIFIED_STATS_TIMEOUT
+            )
+        return self._stats_cache[period]
+    
+    def _build_unified_stats(self, period):
+        """Calcula las estadísticas unificadas desde la base de datos"""
+        from ..models import UserListeningStats
+        
+        # Una sola consulta para las estadísticas del período de todas las conexiones
+        connections = self.get_user_connections().select_related('platform').prefetch_related(
+            Prefetch(
+                'userlisteningstats_set',
+                # Los tops de artistas y géneros se leen de sus columnas binarias
+                queryset=UserListeningStats.objects.filter(period_type=period).defer('top_artists', 'top_genres'),
+                to_attr='period_stats'
+            )
+        )
         
         unified_stats = {
             'total_minutes': 0,
@@ -35,28 +81,32 @@ class MusicAnalysisService:
             'platform_breakdown': []
         }
         
-        # Agregar datos de cada plataforma
+        # Agregar datos de cada plataforma: (plataforma, minutos, tracks)
+        platform_totals = []
         for connection in connections:
             platform_stats = self._get_platform_stats(connection, period)
             if platform_stats:
-                unified_stats['total_minutes'] += platform_stats.get('total_minutes', 0)
-                unified_stats['total_tracks'] += platform_stats.get('total_tracks', 0)
-                
-                # Agregar breakdown por plataforma
-                unified_stats['platform_breakdown'].append({
-                    'platform': connection.platform.display_name,
-                    'color': connection.platform.color,
-                    'minutes': platform_stats.get('total_minutes', 0),
-                    'tracks': platform_stats.get('total_tracks', 0),
-                    'percentage': 0  # Se calculará después
-                })
+                platform_totals.append((
+                    connection.platform,
+                    platform_stats.get('total_minutes', 0),
+                    platform_stats.get('total_tracks', 0)
+                ))
         
-        # Calcular porcentajes
-        if unified_stats['total_minutes'] > 0:
-            for platform in unified_stats['platform_breakdown']:
-                platform['percentage'] = round(
-                    (platform['minutes'] / unified_stats['total_minutes']) * 100, 1
-                )
+        total_minutes = sum(minutes for _, minutes, _ in platform_totals)
+        unified_stats['total_minutes'] = total_minutes
+        unified_stats['total_tracks'] = sum(tracks for _, _, tracks in platform_totals)
+        
+        # Breakdown por plataforma, con el porcentaje ya conocido el total
+        unified_stats['platform_breakdown'] = [
+            {
+                'platform': platform.display_name,
+                'color': platform.color,
+                'minutes': minutes,
+                'tracks': tracks,
+                'percentage': round(minutes / total_minutes * 100, 1) if total_minutes > 0 else 0
+            }
+            for platform, minutes, tracks in platform_totals
+        ]
         
         # Combinar y rankear artistas, géneros y tracks
         unified_stats.update(self._combine_top_data(connections, period))
@@ -66,19 +116,15 @@ class MusicAnalysisService:
     def _get_platform_stats(self, connection, period):
         """Obtiene estadísticas de una plataforma específica"""
         try:
-            # Buscar estadísticas existentes
-            stats = connection.user.listening_stats.filter(
-                platform_connection=connection,
-                period_type=period
-            ).first()
+            # Estadísticas precargadas en get_unified_stats (más recientes primero)
+            stats = connection.period_stats[0] if connection.period_stats else None
             
             if stats:
                 return {
                     'total_minutes': stats.total_minutes,
                     'total_tracks': stats.total_tracks,
                     'unique_artists': stats.unique_artists,
-                    'top_artists': stats.top_artists,
-                    'top_genres': stats.top_genres,
+                    # top_artists/top_genres van diferidos: se combinan en _combine_top_data
                     'top_tracks': stats.top_tracks
                 }
             
@@ -96,46 +142,31 @@ class MusicAnalysisService:
         
         for connection in connections:
             try:
-                stats = connection.user.listening_stats.filter(
-                    platform_connection=connection,
-                    period_type=period
-                ).first()
+                stats = connection.period_stats[0] if connection.period_stats else None
                 
                 if not stats:
                     continue
                 
-                # Combinar artistas
-                for artist_data in stats.top_artists:
-                    artist_name = artist_data.get('name')
-                    minutes = artist_data.get('minutes', 0)
-                    if artist_name:
-                        all_artists[artist_name] += minutes
-                
-                # Combinar géneros
-                for genre_data in stats.top_genres:
-                    genre_name = genre_data.get('name')
-                    minutes = genre_data.get('minutes', 0)
-                    if genre_name:
-                        all_genres[genre_name] += minutes
-                
-                # Combinar tracks
-                for track_data in stats.top_tracks:
-                    track_key = f"{track_data.get('name')} - {track_data.get('artist')}"
-                    minutes = track_data.get('minutes', 0)
-                    if track_key:
-                        all_tracks[track_key] += minutes
+                # Counter.update suma los minutos de cada plataforma
+                all_artists.update(stats.artist_minutes)
+                all_genres.update(stats.genre_minutes)
+                all_tracks.update({
+                    f"{track_data.get('name')} - {track_data.get('artist')}": track_data.get('minutes', 0)
+                    for track_data in stats.top_tracks
+                })
                         
             except Exception as e:
                 logger.error(f"Error combining data from {connection.platform.name}: {e}")
                 continue
         
         return {
+            # name_lc evita repetir .lower() en cada comparación entre usuarios
             'top_artists': [
-                {'name': name, 'minutes': minutes, 'rank': i+1}
+                {'name': name, 'name_lc': name.lower(), 'minutes': minutes, 'rank': i+1}
                 for i, (name, minutes) in enumerate(all_artists.most_common(20))
             ],
             'top_genres': [
-                {'name': name, 'minutes': minutes, 'rank': i+1}
+                {'name': name, 'name_lc': name.lower(), 'minutes': minutes, 'rank': i+1}
                 for i, (name, minutes) in enumerate(all_genres.most_common(15))
             ],
             'top_tracks': [
@@ -151,17 +182,26 @@ class MusicAnalysisService:
             user1_stats = self.get_unified_stats()
             user2_stats = MusicAnalysisService(other_user).get_unified_stats()
             
-            # Calcular compatibilidad de artistas
-            artist_compatibility = self._calculate_artist_compatibility(
-                user1_stats['top_artists'], 
-                user2_stats['top_artists']
-            )
+            artists1 = self._name_set(user1_stats['top_artists'])
+            artists2 = self._name_set(user2_stats['top_artists'])
+            genres1 = self._name_set(user1_stats['top_genres'])
+            genres2 = self._name_set(user2_stats['top_genres'])
             
-            # Calcular compatibilidad de géneros
-            genre_compatibility = self._calculate_genre_compatibility(
-                user1_stats['top_genres'], 
-                user2_stats['top_genres']
-            )
+            # Sin artistas ni géneros en común la compatibilidad es 0: no hace
+            # falta calcular Jaccard ni buscar elementos compartidos
+            if artists1.isdisjoint(artists2) and genres1.isdisjoint(genres2):
+                return {
+                    'overall_compatibility': 0.0,
+                    'artist_compatibility': 0.0,
+                    'genre_compatibility': 0.0,
+                    'shared_artists': [],
+                    'shared_genres': [],
+                    'compatibility_level': self._get_compatibility_level(0.0)
+                }
+            
+            # Calcular compatibilidad de artistas y géneros
+            artist_compatibility = self._jaccard_percentage(artists1, artists2)
+            genre_compatibility = self._jaccard_percentage(genres1, genres2)
             
             # Compatibilidad general (promedio ponderado)
             overall_compatibility = (artist_compatibility * 0.6) + (genre_compatibility * 0.4)
@@ -183,8 +223,8 @@ class MusicAnalysisService:
                 'overall_compatibility': round(overall_compatibility, 1),
                 'artist_compatibility': round(artist_compatibility, 1),
                 'genre_compatibility': round(genre_compatibility, 1),
-                'shared_artists': shared_artists[:10],  # Top 10 compartidos
-                'shared_genres': shared_genres[:10],
+                'shared_artists': shared_artists,  # Top 10 compartidos
+                'shared_genres': shared_genres,
                 'compatibility_level': self._get_compatibility_level(overall_compatibility)
             }
             
@@ -194,93 +234,84 @@ class MusicAnalysisService:
     
     def _calculate_artist_compatibility(self, artists1, artists2):
         """Calcula compatibilidad basada en artistas"""
-        if not artists1 or not artists2:
-            return 0.0
-        
-        # Crear sets de artistas para cada usuario
-        set1 = {artist['name'].lower() for artist in artists1}
-        set2 = {artist['name'].lower() for artist in artists2}
-        
-        # Calcular intersección y unión
-        intersection = len(set1.intersection(set2))
-        union = len(set1.union(set2))
-        
-        if union == 0:
-            return 0.0
-        
-        # Índice de Jaccard modificado (0-100)
-        jaccard_index = intersection / union
-        return jaccard_index * 100
+        return self._jaccard_percentage(self._name_set(artists1), self._name_set(artists2))
     
     def _calculate_genre_compatibility(self, genres1, genres2):
         """Calcula compatibilidad basada en géneros"""
-        if not genres1 or not genres2:
+        return self._jaccard_percentage(self._name_set(genres1), self._name_set(genres2))
+    
+    def _name_set(self, items):
+        """Conjunto de nombres normalizados de una lista de top"""
+        return frozenset(item['name_lc'] for item in items)
+    
+    def _jaccard_percentage(self, set1, set2):
+        """Índice de Jaccard (0-100) entre dos conjuntos de nombres"""
+        if not set1 or not set2:
             return 0.0
         
-        # Crear sets de géneros
-        set1 = {genre['name'].lower() for genre in genres1}
-        set2 = {genre['name'].lower() for genre in genres2}
-        
-        # Calcular intersección y unión
-        intersection = len(set1.intersection(set2))
-        union = len(set1.union(set2))
+        # |A ∪ B| = |A| + |B| - |A ∩ B|, sin construir el conjunto unión
+        intersection = len(set1 & set2)
+        union = len(set1) + len(set2) - intersection
         
         if union == 0:
             return 0.0
         
-        # Índice de Jaccard (0-100)
-        jaccard_index = intersection / union
-        return jaccard_index * 100
+        return intersection / union * 100
     
-    def _find_shared_items(self, list1, list2, key):
-        """Encuentra elementos compartidos entre dos listas"""
-        items1 = {item[key].lower(): item for item in list1}
-        items2 = {item[key].lower(): item for item in list2}
+    def _find_shared_items(self, list1, list2, key, limit=10):
+        """Encuentra los elementos compartidos con más minutos combinados"""
+        items2 = {item['name_lc']: item for item in list2}
         
         shared = []
-        for name in items1.keys():
-            if name in items2:
+        for item in list1:
+            other = items2.get(item['name_lc'])
+            if other is not None:
                 shared.append({
-                    'name': items1[name][key],
-                    'user1_minutes': items1[name].get('minutes', 0),
-                    'user2_minutes': items2[name].get('minutes', 0)
+                    'name': item[key],
+                    'user1_minutes': item.get('minutes', 0),
+                    'user2_minutes': other.get('minutes', 0)
                 })
         
-        # Ordenar por minutos combinados
-        shared.sort(key=lambda x: x['user1_minutes'] + x['user2_minutes'], reverse=True)
-        return shared
+        # Top por minutos combinados sin ordenar la lista completa
+        return heapq.nlargest(limit, shared, key=lambda x: x['user1_minutes'] + x['user2_minutes'])
     
     def _get_compatibility_level(self, score):
         """Determina el nivel de compatibilidad basado en el puntaje"""
-        if score >= 80:
-            return {'level': 'Gemelos Musicales', 'emoji': '🎭', 'color': '#FF6B6B'}
-        elif score >= 65:
-            return {'level': 'Muy Compatible', 'emoji': '🎵', 'color': '#4ECDC4'}
-        elif score >= 50:
-            return {'level': 'Compatible', 'emoji': '🎶', 'color': '#45B7D1'}
-        elif score >= 35:
-            return {'level': 'Algo en Común', 'emoji': '🎸', 'color': '#F9CA24'}
-        elif score >= 20:
-            return {'level': 'Diferente Onda', 'emoji': '🎤', 'color': '#E17055'}
-        else:
-            return {'level': 'Mundos Aparte', 'emoji': '🌍', 'color': '#636E72'}
+        # bisect_right: un puntaje igual al umbral pertenece al tramo superior
+        return dict(COMPATIBILITY_LEVELS[bisect.bisect_right(COMPATIBILITY_THRESHOLDS, score)])
     
     def get_music_recommendations(self, limit=20):
         """Genera recomendaciones musicales basadas en amigos con gustos similares"""
+        from ..models import Friendship, MusicCompatibility
+        
         try:
             # Obtener amigos con alta compatibilidad
             compatible_friends = []
             
-            # Obtener amistades aceptadas
-            friendships = self.user.sent_friend_requests.filter(status='accepted').union(
-                self.user.received_friend_requests.filter(status='accepted')
-            )
+            # Amistades aceptadas en ambas direcciones, con los usuarios en la misma consulta
+            friendships = Friendship.objects.filter(
+                Q(requester=self.user) | Q(addressee=self.user),
+                status='accepted'
+            ).select_related('requester', 'addressee')
             
-            for friendship in friendships:
-                friend = friendship.addressee if friendship.requester == self.user else friendship.requester
-                
+            friends = [
+                friendship.addressee if friendship.requester_id == self.user.pk else friendship.requester
+                for friendship in friendships
+            ]
+            
+            # Compatibilidades ya guardadas con todos los amigos en una sola consulta
+            compat_by_friend = {}
+            for compat in MusicCompatibility.objects.filter(
+                Q(user1=self.user, user2__in=friends) | Q(user2=self.user, user1__in=friends)
+            ):
+                friend_id = compat.user2_id if compat.user1_id == self.user.pk else compat.user1_id
+                # Prioridad a la fila guardada desde este usuario, como en la búsqueda individual
+                if friend_id not in compat_by_friend or compat.user1_id == self.user.pk:
+                    compat_by_friend[friend_id] = compat
+            
+            for friend in friends:
                 # Obtener o calcular compatibilidad
-                compatibility = self._get_or_calculate_compatibility(friend)
+                compatibility = self._get_or_calculate_compatibility(friend, prefetched=compat_by_friend)
                 if compatibility and compatibility['overall_compatibility'] >= 40:
                     compatible_friends.append({
                         'friend': friend,
@@ -290,48 +321,62 @@ class MusicAnalysisService:
             # Ordenar por compatibilidad
             compatible_friends.sort(key=lambda x: x['compatibility']['overall_compatibility'], reverse=True)
             
-            # Generar recomendaciones basadas en amigos compatibles
-            recommendations = []
-            user_artists = set(artist['name'].lower() for artist in self.get_unified_stats()['top_artists'])
+            # Generar recomendaciones basadas en amigos compatibles, una por artista
+            best = {}
+            user_artists = frozenset(artist['name_lc'] for artist in self.get_unified_stats()['top_artists'])
             
-            for friend_data in compatible_friends[:5]:  # Top 5 amigos más compatibles
-                friend_stats = MusicAnalysisService(friend_data['friend']).get_unified_stats()
-                
-                for artist in friend_stats['top_artists'][:10]:  # Top 10 del amigo
-                    if artist['name'].lower() not in user_artists:
-                        recommendations.append({
-                            'artist_name': artist['name'],
-                            'minutes': artist['minutes'],
-                            'recommended_by': friend_data['friend'].display_name,
-                            'compatibility_score': friend_data['compatibility']['overall_compatibility'],
-                            'reason': f"A {friend_data['friend'].display_name} le encanta (compatibilidad: {friend_data['compatibility']['overall_compatibility']}%)"
-                        })
+            top_friends = compatible_friends[:5]  # Top 5 amigos más compatibles
+            with ThreadPoolExecutor(max_workers=FRIEND_STATS_WORKERS) as executor:
+                friends_stats = list(executor.map(
+                    self._get_friend_stats, [friend_data['friend'] for friend_data in top_friends]
+                ))
             
-            # Remover duplicados y limitar
-            seen = set()
-            unique_recommendations = []
-            for rec in recommendations:
-                if rec['artist_name'].lower() not in seen:
-                    seen.add(rec['artist_name'].lower())
-                    unique_recommendations.append(rec)
+            for friend_data, friend_stats in zip(top_friends, friends_stats):
+                for artist in friend_stats['top_artists'][:10]:  # Top 10 del amigo
+                    key = artist['name_lc']
+                    if key in user_artists:
+                        continue
+                    rec = {
+                        'artist_name': artist['name'],
+                        'minutes': artist['minutes'],
+                        'recommended_by': friend_data['friend'].display_name,
+                        'compatibility_score': friend_data['compatibility']['overall_compatibility'],
+                        'reason': f"A {friend_data['friend'].display_name} le encanta (compatibilidad: {friend_data['compatibility']['overall_compatibility']}%)"
+                    }
+                    # Quedarse con la recomendación del amigo más compatible
+                    if key not in best or rec['compatibility_score'] > best[key]['compatibility_score']:
+                        best[key] = rec
             
-            return unique_recommendations[:limit]
+            return heapq.nlargest(limit, best.values(), key=lambda r: r['compatibility_score'])
             
         except Exception as e:
             logger.error(f"Error generating music recommendations: {e}")
             return []
     
-    def _get_or_calculate_compatibility(self, other_user):
+    @staticmethod
+    def _get_friend_stats(friend):
+        """Estadísticas unificadas de un amigo, pensado para ejecutarse en un hilo"""
+        try:
+            return MusicAnalysisService(friend).get_unified_stats()
+        finally:
+            # Cada hilo abre su propia conexión a la BD; no dejarla abierta
+            connection.close()
+    
+    def _get_or_calculate_compatibility(self, other_user, prefetched=None):
         """Obtiene compatibilidad existente o la calcula"""
-        from .models import MusicCompatibility
+        from ..models import MusicCompatibility
         
         try:
-            # Buscar compatibilidad existente (en cualquier dirección)
-            compatibility = MusicCompatibility.objects.filter(
-                user1=self.user, user2=other_user
-            ).first() or MusicCompatibility.objects.filter(
-                user1=other_user, user2=self.user
-            ).first()
+            if prefetched is not None:
+                # Filas ya cargadas por el llamador, indexadas por id del otro usuario
+                compatibility = prefetched.get(other_user.pk)
+            else:
+                # Buscar compatibilidad existente (en cualquier dirección)
+                compatibility = MusicCompatibility.objects.filter(
+                    user1=self.user, user2=other_user
+                ).first() or MusicCompatibility.objects.filter(
+                    user1=other_user, user2=self.user
+                ).first()
             
             if compatibility:
                 return {
@@ -1,13 +1,56 @@
 import spotipy
+from spotipy.cache_handler import MemoryCacheHandler
 from spotipy.oauth2 import SpotifyOAuth
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 import logging
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+# Columnas reales de User (los campos spotify_* se eliminaron del modelo)
+USER_COLUMNS = frozenset(field.name for field in User._meta.concrete_fields)
+
+# Margen antes de la caducidad en el que ya se renueva el token
+TOKEN_REFRESH_MARGIN = timezone.timedelta(seconds=60)
+
+# Páginas de un listado que se piden a la vez (sin pasar del rate limit de Spotify)
+PAGE_WORKERS = 4
+
+# Campos de cada página de canciones que usa la importación; el resto no se descarga
+PLAYLIST_TRACK_FIELDS = (
+    'total,items(track(id,name,type,duration_ms,preview_url,external_urls,artists(name),album(name)))'
+)
+
+
+@dataclass(slots=True)
+class TrackRow:
+    """Canción de una playlist de Spotify tal como se importa"""
+    spotify_id: str
+    name: str
+    artists: list
+    album: str
+    duration_ms: int
+    preview_url: str | None
+    spotify_url: str | None
+
+
+@lru_cache(maxsize=1024)
+def _spotify_client(access_token):
+    """Cliente de Spotify por token; reutiliza su sesión HTTP entre peticiones"""
+    # Los tokens caducan en una hora y el siguiente es otra clave: los
+    # clientes viejos salen de la caché por LRU
+    return spotipy.Spotify(
+        auth=access_token,
+        retries=3,
+        status_forcelist=(429, 500, 502, 503, 504)
+    )
+
 
 class SpotifyAuthService:
     """Servicio para manejar la autenticación con Spotify"""
@@ -25,19 +68,28 @@ class SpotifyAuthService:
             'playlist-modify-public',
             'playlist-modify-private'
         ]
+        self._sp_oauth = None
     
-    def get_auth_url(self):
-        """Obtener URL de autorización de Spotify"""
-        try:
-            sp_oauth = SpotifyOAuth(
+    @property
+    def sp_oauth(self):
+        """Cliente OAuth de Spotify, creado una sola vez por servicio"""
+        if self._sp_oauth is None:
+            # Tokens en memoria: spotipy no escribe ficheros .cache compartidos
+            # entre usuarios; show_dialog solo afecta a la URL de autorización
+            self._sp_oauth = SpotifyOAuth(
                 client_id=self.client_id,
                 client_secret=self.client_secret,
                 redirect_uri=self.redirect_uri,
                 scope=' '.join(self.scope),
-                show_dialog=True
+                show_dialog=True,
+                cache_handler=MemoryCacheHandler()
             )
-            
-            auth_url = sp_oauth.get_authorize_url()
+        return self._sp_oauth
+    
+    def get_auth_url(self):
+        """Obtener URL de autorización de Spotify"""
+        try:
+            auth_url = self.sp_oauth.get_authorize_url()
             return {'auth_url': auth_url}
             
         except Exception as e:
@@ -47,14 +99,7 @@ class SpotifyAuthService:
     def exchange_code_for_tokens(self, code):
         """Intercambiar código de autorización por tokens"""
         try:
-            sp_oauth = SpotifyOAuth(
-                client_id=self.client_id,
-                client_secret=self.client_secret,
-                redirect_uri=self.redirect_uri,
-                scope=' '.join(self.scope)
-            )
-            
-            token_info = sp_oauth.get_access_token(code)
+            token_info = self.sp_oauth.get_access_token(code, check_cache=False)
             return token_info
             
         except Exception as e:
@@ -75,15 +120,8 @@ class SpotifyAuthService:
     def handle_callback(self, code, user):
         """Manejar callback de autorización de Spotify"""
         try:
-            sp_oauth = SpotifyOAuth(
-                client_id=self.client_id,
-                client_secret=self.client_secret,
-                redirect_uri=self.redirect_uri,
-                scope=' '.join(self.scope)
-            )
-            
             # Intercambiar código por tokens
-            token_info = sp_oauth.get_access_token(code)
+            token_info = self.sp_oauth.get_access_token(code, check_cache=False)
             
             if not token_info:
                 raise Exception("No se pudo obtener token de acceso")
@@ -95,18 +133,19 @@ class SpotifyAuthService:
             spotify_user = sp.current_user()
             
             # Actualizar información del usuario
-            user.spotify_user_id = spotify_user['id']
-            user.spotify_display_name = spotify_user.get('display_name') or spotify_user['id']
-            user.spotify_access_token = token_info['access_token']
-            user.spotify_refresh_token = token_info.get('refresh_token')
-            user.spotify_token_expires_at = timezone.now() + timezone.timedelta(
-                seconds=token_info.get('expires_in', 3600)
-            )
-            user.profile_image = spotify_user['images'][0]['url'] if spotify_user['images'] else None
-            user.country = spotify_user.get('country')
-            user.spotify_premium = spotify_user.get('product') == 'premium'
-            user.spotify_connected_at = timezone.now()
-            user.save()
+            self._update_user(user, {
+                'spotify_user_id': spotify_user['id'],
+                'spotify_display_name': spotify_user.get('display_name') or spotify_user['id'],
+                'spotify_access_token': token_info['access_token'],
+                'spotify_refresh_token': token_info.get('refresh_token'),
+                'spotify_token_expires_at': timezone.now() + timezone.timedelta(
+                    seconds=token_info.get('expires_in', 3600)
+                ),
+                'profile_image': spotify_user['images'][0]['url'] if spotify_user['images'] else None,
+                'country': spotify_user.get('country'),
+                'spotify_premium': spotify_user.get('product') == 'premium',
+                'spotify_connected_at': timezone.now()
+            })
             
             return {
                 'success': True,
@@ -132,23 +171,18 @@ class SpotifyAuthService:
             if not user.spotify_refresh_token:
                 raise Exception("No hay refresh token disponible")
             
-            sp_oauth = SpotifyOAuth(
-                client_id=self.client_id,
-                client_secret=self.client_secret,
-                redirect_uri=self.redirect_uri,
-                scope=' '.join(self.scope)
-            )
+            token_info = self.sp_oauth.refresh_access_token(user.spotify_refresh_token)
             
-            token_info = sp_oauth.refresh_access_token(user.spotify_refresh_token)
-            
-            # Actualizar tokens
-            user.spotify_access_token = token_info['access_token']
+            # Actualizar tokens (solo esas columnas)
+            fields = {
+                'spotify_access_token': token_info['access_token'],
+                'spotify_token_expires_at': timezone.now() + timezone.timedelta(
+                    seconds=token_info.get('expires_in', 3600)
+                )
+            }
             if 'refresh_token' in token_info:
-                user.spotify_refresh_token = token_info['refresh_token']
-            user.spotify_token_expires_at = timezone.now() + timezone.timedelta(
-                seconds=token_info.get('expires_in', 3600)
-            )
-            user.save()
+                fields['spotify_refresh_token'] = token_info['refresh_token']
+            self._update_user(user, fields)
             
             return True
             
@@ -158,16 +192,26 @@ class SpotifyAuthService:
     
     def disconnect_user(self, user):
         """Desconectar usuario de Spotify"""
-        user.spotify_user_id = None
-        user.spotify_display_name = None
-        user.spotify_access_token = None
-        user.spotify_refresh_token = None
-        user.spotify_token_expires_at = None
-        user.spotify_connected_at = None
-        user.profile_image = None
-        user.country = None
-        user.spotify_premium = False
-        user.save()
+        self._update_user(user, {
+            'spotify_user_id': None,
+            'spotify_display_name': None,
+            'spotify_access_token': None,
+            'spotify_refresh_token': None,
+            'spotify_token_expires_at': None,
+            'spotify_connected_at': None,
+            'profile_image': None,
+            'country': None,
+            'spotify_premium': False
+        })
+    
+    def _update_user(self, user, fields):
+        """Escribe solo las columnas indicadas que existen en User y las refleja todas en la instancia"""
+        # Los datos spotify_* ya no son columnas de User: solo viven en la instancia
+        columns = {field: value for field, value in fields.items() if field in USER_COLUMNS}
+        if columns:
+            User.objects.filter(pk=user.pk).update(**columns)
+        for field, value in fields.items():
+            setattr(user, field, value)
 
 
 class SpotifyPlaylistService:
@@ -178,9 +222,9 @@ class SpotifyPlaylistService:
         if not user.has_spotify_connected:
             raise Exception("Usuario no conectado a Spotify")
         
-        # Verificar si el token ha expirado y refrescarlo automáticamente
+        # Refrescar el token si ha expirado o está a punto de hacerlo
         if (user.spotify_token_expires_at and 
-            timezone.now() >= user.spotify_token_expires_at):
+            timezone.now() + TOKEN_REFRESH_MARGIN >= user.spotify_token_expires_at):
             auth_service = SpotifyAuthService()
             success = auth_service.refresh_token(user)
             if not success:
@@ -190,15 +234,19 @@ class SpotifyPlaylistService:
         if not user.spotify_access_token:
             raise Exception("No hay token de acceso válido. Por favor, reconecta tu cuenta de Spotify.")
         
-        self.sp = spotipy.Spotify(auth=user.spotify_access_token)
+        self.sp = _spotify_client(user.spotify_access_token)
     
     def get_user_playlists(self):
         """Obtener playlists del usuario"""
         try:
             playlists = []
-            results = self.sp.current_user_playlists(limit=50)
+            pages = self._fetch_all_pages(
+                self.sp.current_user_playlists(limit=50),
+                lambda offset: self.sp.current_user_playlists(limit=50, offset=offset),
+                50
+            )
             
-            while results:
+            for results in pages:
                 for playlist in results['items']:
                     playlists.append({
                         'id': playlist['id'],
@@ -210,11 +258,6 @@ class SpotifyPlaylistService:
                         'owner': playlist['owner']['display_name'],
                         'images': playlist['images']
                     })
-                
-                if results['next']:
-                    results = self.sp.next(results)
-                else:
-                    break
             
             return playlists
             
@@ -222,6 +265,16 @@ class SpotifyPlaylistService:
             logger.error(f"Error al obtener playlists: {e}")
             raise Exception("Error al obtener playlists de Spotify")
     
+    def _fetch_all_pages(self, first_page, fetch_page, limit):
+        """Devuelve todas las páginas de un listado, pidiendo las restantes en paralelo"""
+        # La primera página trae el total: el resto de offsets se conoce de antemano
+        offsets = range(limit, first_page['total'], limit)
+        if not offsets:
+            return [first_page]
+        
+        with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+            return [first_page, *executor.map(fetch_page, offsets)]
+    
     def import_playlist(self, spotify_playlist_id, name=None, description=None):
         """Importar una playlist desde Spotify"""
         try:
@@ -243,50 +296,66 @@ class SpotifyPlaylistService:
             if existing_playlist:
                 raise Exception("Esta playlist ya ha sido importada")
             
-            # Crear la playlist en la base de datos
-            playlist = Playlist.objects.create(
-                user=self.user,
-                spotify_id=spotify_playlist_id,
-                name=playlist_name,
-                description=playlist_description,
-                total_tracks=playlist_info['tracks']['total']
-            )
-            
-            # Obtener las canciones de la playlist
+            # Obtener las canciones antes de abrir la transacción (llamadas HTTP)
             tracks = self.get_playlist_tracks(spotify_playlist_id)
             
-            # Importar las canciones
-            for position, track_data in enumerate(tracks):
-                # Crear o obtener la canción usando name + artist como clave única
-                song, created = Song.objects.get_or_create(
-                    name=track_data['name'],
-                    artist=', '.join(track_data['artists']),
-                    defaults={
-                        'album': track_data['album'],
-                        'spotify_id': track_data['spotify_id'],
-                        'duration_ms': track_data['duration_ms'],
-                        'preview_url': track_data.get('preview_url'),
-                        'spotify_url': track_data['external_urls'].get('spotify')
-                    }
+            with transaction.atomic():
+                # Crear la playlist en la base de datos
+                playlist = Playlist.objects.create(
+                    user=self.user,
+                    spotify_id=spotify_playlist_id,
+                    name=playlist_name,
+                    description=playlist_description,
+                    total_tracks=len(tracks)
                 )
                 
+                # Una canción por name + artist (clave única del modelo)
+                keys = [(track.name, ', '.join(track.artists)) for track in tracks]
+                new_songs = {}
+                for key, track in zip(keys, tracks):
+                    if key not in new_songs:
+                        new_songs[key] = Song(
+                            name=key[0],
+                            artist=key[1],
+                            album=track.album,
+                            spotify_id=track.spotify_id,
+                            duration_ms=track.duration_ms,
+                            preview_url=track.preview_url,
+                            spotify_url=track.spotify_url
+                        )
+                
+                # Insertar las nuevas en bloque; las existentes se ignoran
+                Song.objects.bulk_create(new_songs.values(), ignore_conflicts=True, batch_size=500)
+                
+                songs = {
+                    (song.name, song.artist): song
+                    for song in Song.objects.filter(
+                        name__in={name for name, _ in new_songs},
+                        artist__in={artist for _, artist in new_songs}
+                    )
+                }
+                
                 # Si la canción ya existía pero no tenía spotify_id, actualizarlo
-                if not created and not song.spotify_id:
-                    song.spotify_id = track_data['spotify_id']
-                    if not song.spotify_url:
-                        song.spotify_url = track_data['external_urls'].get('spotify')
-                    song.save()
+                songs_to_update = []
+                for key, new_song in new_songs.items():
+                    song = songs.get(key)
+                    if song is None:
+                        # La colación de la BD puede emparejar claves que en Python difieren
+                        song = songs[key] = Song.objects.get(name=key[0], artist=key[1])
+                    if not song.spotify_id:
+                        song.spotify_id = new_song.spotify_id
+                        if not song.spotify_url:
+                            song.spotify_url = new_song.spotify_url
+                        songs_to_update.append(song)
                 
-                # Asociar la canción con la playlist
-                PlaylistSong.objects.create(
-                    playlist=playlist,
-                    song=song,
-                    position=position + 1
-                )
-            
-            # Actualizar el total de tracks
-            playlist.total_tracks = len(tracks)
-            playlist.save()
+                if songs_to_update:
+                    Song.objects.bulk_update(songs_to_update, ['spotify_id', 'spotify_url'], batch_size=500)
+                
+                # Asociar las canciones con la playlist
+                PlaylistSong.objects.bulk_create([
+                    PlaylistSong(playlist=playlist, song=songs[key], position=position + 1)
+                    for position, key in enumerate(keys)
+                ], batch_size=500)
             
             return playlist
             
@@ -297,29 +366,28 @@ class SpotifyPlaylistService:
     def get_playlist_tracks(self, playlist_id):
         """Obtener canciones de una playlist"""
         try:
-            tracks = []
-            results = self.sp.playlist_tracks(playlist_id)
-            
-            while results:
-                for item in results['items']:
-                    if item['track'] and item['track']['type'] == 'track':
-                        track = item['track']
-                        tracks.append({
-                            'spotify_id': track['id'],
-                            'name': track['name'],
-                            'artists': [artist['name'] for artist in track['artists']],
-                            'album': track['album']['name'],
-                            'duration_ms': track['duration_ms'],
-                            'preview_url': track['preview_url'],
-                            'external_urls': track['external_urls']
-                        })
-                
-                if results['next']:
-                    results = self.sp.next(results)
-                else:
-                    break
+            pages = self._fetch_all_pages(
+                self.sp.playlist_tracks(playlist_id, fields=PLAYLIST_TRACK_FIELDS, limit=100),
+                lambda offset: self.sp.playlist_tracks(
+                    playlist_id, fields=PLAYLIST_TRACK_FIELDS, limit=100, offset=offset
+                ),
+                100
+            )
             
-            return tracks
+            return [
+                TrackRow(
+                    spotify_id=track['id'],
+                    name=track['name'],
+                    artists=[artist['name'] for artist in track['artists']],
+                    album=track['album']['name'],
+                    duration_ms=track['duration_ms'],
+                    preview_url=track['preview_url'],
+                    spotify_url=track['external_urls'].get('spotify')
+                )
+                for results in pages
+                for item in results['items']
+                if (track := item['track']) and track['type'] == 'track'
+            ]
             
         except Exception as e:
             logger.error(f"Error al obtener tracks de playlist: {e}")
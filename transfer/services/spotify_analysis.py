@@ -2,16 +2,82 @@
 Servicio de análisis musical de Spotify para la red social
 """
 import requests
-import json
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import hashlib
+import orjson
 import logging
-from datetime import datetime, timedelta
-from collections import Counter, defaultdict
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import chain
+from datetime import timedelta
+from collections import Counter
+from django.core.cache import cache
 from django.utils import timezone
-from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+# Peticiones independientes a la API que se lanzan a la vez en un análisis
+ANALYSIS_WORKERS = 4
+
+# Segundos que se reutiliza un análisis de escucha para el mismo token y período
+ANALYSIS_CACHE_TIMEOUT = 900
+
+# Características de audio que se promedian en el perfil musical
+AUDIO_FEATURES = (
+    'danceability', 'energy', 'speechiness', 'acousticness',
+    'instrumentalness', 'liveness', 'valence', 'tempo'
+)
+
+# Reproducciones estimadas según el puesto en el top (no dependen del usuario)
+ARTIST_PLAYS_BY_RANK = tuple(max(100 // rank, 1) for rank in range(1, 21))
+TRACK_PLAYS_BY_RANK = tuple(max(50 // rank, 1) for rank in range(1, 51))
+
+# Segundos máximos de espera por petición a la API (sin esto un hilo puede quedarse colgado)
+REQUEST_TIMEOUT = 10
+
+# Sesión compartida con la API de Spotify: conexiones keep-alive y reintentos
+# (en un 429 urllib3 respeta la cabecera Retry-After)
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False  # Agotados los reintentos, devolver la respuesta y comprobar status_code
+    )
+))
+
+
+@dataclass(slots=True)
+class ArtistRow:
+    """Artista del top de Spotify con los campos que usa el análisis"""
+    name: str
+    spotify_id: str
+    genres: list = field(default_factory=list)
+    popularity: int = 0
+    followers: int = 0
+    image_url: str | None = None
+    external_url: str | None = None
+
+
+@dataclass(slots=True)
+class TopTrackRow:
+    """Canción del top o de las reproducciones recientes de Spotify"""
+    name: str
+    artist: str
+    album: str
+    spotify_id: str
+    duration_ms: int = 0
+    popularity: int = 0
+    preview_url: str | None = None
+    external_url: str | None = None
+    image_url: str | None = None
+    played_at: str | None = None
+
 
 class SpotifyMusicAnalysisService:
     """Servicio para análisis musical detallado de Spotify"""
@@ -23,13 +89,15 @@ class SpotifyMusicAnalysisService:
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
         }
+        self._recently_played = None
+        self._feature_cache = {}
     
     def get_user_profile(self):
         """Obtiene perfil del usuario de Spotify"""
         try:
-            response = requests.get(f"{self.base_url}/me", headers=self.headers)
+            response = _SESSION.get(f"{self.base_url}/me", headers=self.headers, timeout=REQUEST_TIMEOUT)
             if response.status_code == 200:
-                return response.json()
+                return orjson.loads(response.content)
             return None
         except Exception as e:
             logger.error(f"Error getting user profile: {e}")
@@ -41,26 +109,28 @@ class SpotifyMusicAnalysisService:
         time_range: short_term (4 weeks), medium_term (6 months), long_term (years)
         """
         try:
-            response = requests.get(
+            response = _SESSION.get(
                 f"{self.base_url}/me/top/artists",
                 headers=self.headers,
+                timeout=REQUEST_TIMEOUT,
                 params={'time_range': time_range, 'limit': limit}
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 artists = []
                 
                 for artist in data.get('items', []):
-                    artists.append({
-                        'name': artist['name'],
-                        'spotify_id': artist['id'],
-                        'genres': artist.get('genres', []),
-                        'popularity': artist.get('popularity', 0),
-                        'followers': artist.get('followers', {}).get('total', 0),
-                        'image_url': artist.get('images', [{}])[0].get('url') if artist.get('images') else None,
-                        'external_url': artist.get('external_urls', {}).get('spotify')
-                    })
+                    images = artist.get('images')
+                    artists.append(ArtistRow(
+                        name=artist['name'],
+                        spotify_id=artist['id'],
+                        genres=artist.get('genres', []),
+                        popularity=artist.get('popularity', 0),
+                        followers=artist.get('followers', {}).get('total', 0),
+                        image_url=images[0].get('url') if images else None,
+                        external_url=artist.get('external_urls', {}).get('spotify')
+                    ))
                 
                 return artists
             
@@ -73,28 +143,31 @@ class SpotifyMusicAnalysisService:
     def get_top_tracks(self, time_range='medium_term', limit=50):
         """Obtiene canciones más escuchadas"""
         try:
-            response = requests.get(
+            response = _SESSION.get(
                 f"{self.base_url}/me/top/tracks",
                 headers=self.headers,
+                timeout=REQUEST_TIMEOUT,
                 params={'time_range': time_range, 'limit': limit}
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 tracks = []
                 
                 for track in data.get('items', []):
-                    tracks.append({
-                        'name': track['name'],
-                        'artist': ', '.join([artist['name'] for artist in track['artists']]),
-                        'album': track['album']['name'],
-                        'spotify_id': track['id'],
-                        'duration_ms': track.get('duration_ms', 0),
-                        'popularity': track.get('popularity', 0),
-                        'preview_url': track.get('preview_url'),
-                        'external_url': track.get('external_urls', {}).get('spotify'),
-                        'image_url': track['album'].get('images', [{}])[0].get('url') if track['album'].get('images') else None
-                    })
+                    album = track['album']
+                    images = album.get('images')
+                    tracks.append(TopTrackRow(
+                        name=track['name'],
+                        artist=', '.join([artist['name'] for artist in track['artists']]),
+                        album=album['name'],
+                        spotify_id=track['id'],
+                        duration_ms=track.get('duration_ms', 0),
+                        popularity=track.get('popularity', 0),
+                        preview_url=track.get('preview_url'),
+                        external_url=track.get('external_urls', {}).get('spotify'),
+                        image_url=images[0].get('url') if images else None
+                    ))
                 
                 return tracks
             
@@ -107,27 +180,28 @@ class SpotifyMusicAnalysisService:
     def get_recently_played(self, limit=50):
         """Obtiene canciones reproducidas recientemente"""
         try:
-            response = requests.get(
+            response = _SESSION.get(
                 f"{self.base_url}/me/player/recently-played",
                 headers=self.headers,
+                timeout=REQUEST_TIMEOUT,
                 params={'limit': limit}
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 tracks = []
                 
                 for item in data.get('items', []):
                     track = item['track']
-                    tracks.append({
-                        'name': track['name'],
-                        'artist': ', '.join([artist['name'] for artist in track['artists']]),
-                        'album': track['album']['name'],
-                        'played_at': item['played_at'],
-                        'spotify_id': track['id'],
-                        'duration_ms': track.get('duration_ms', 0),
-                        'external_url': track.get('external_urls', {}).get('spotify')
-                    })
+                    tracks.append(TopTrackRow(
+                        name=track['name'],
+                        artist=', '.join([artist['name'] for artist in track['artists']]),
+                        album=track['album']['name'],
+                        played_at=item['played_at'],
+                        spotify_id=track['id'],
+                        duration_ms=track.get('duration_ms', 0),
+                        external_url=track.get('external_urls', {}).get('spotify')
+                    ))
                 
                 return tracks
             
@@ -137,52 +211,108 @@ class SpotifyMusicAnalysisService:
             logger.error(f"Error getting recently played: {e}")
             return []
     
+    def _get_shared_recently_played(self):
+        """Reproducciones recientes, pedidas una vez por instancia"""
+        # No dependen del time_range: analizar varios períodos reutiliza la misma respuesta
+        if self._recently_played is None:
+            self._recently_played = self.get_recently_played()
+        return self._recently_played
+    
     def get_audio_features(self, track_ids):
         """Obtiene características de audio para múltiples tracks"""
         try:
             if not track_ids:
                 return []
             
-            # Spotify API permite hasta 100 IDs por request
-            chunks = [track_ids[i:i+100] for i in range(0, len(track_ids), 100)]
-            all_features = []
-            
-            for chunk in chunks:
-                response = requests.get(
-                    f"{self.base_url}/audio-features",
-                    headers=self.headers,
-                    params={'ids': ','.join(chunk)}
-                )
+            # Las características de un track no cambian: primero la caché de la
+            # instancia, después la de Django (sin caducidad) y solo al final la API
+            features_by_id = {
+                track_id: self._feature_cache[track_id]
+                for track_id in track_ids if track_id in self._feature_cache
+            }
+            pending = [track_id for track_id in dict.fromkeys(track_ids) if track_id not in features_by_id]
+            if pending:
+                cached = cache.get_many([f"spotify_audio_features:{track_id}" for track_id in pending])
+                features_by_id.update({key.split(':', 1)[1]: features for key, features in cached.items()})
+            missing = [track_id for track_id in pending if track_id not in features_by_id]
+            
+            if missing:
+                # Spotify API permite hasta 100 IDs por request
+                chunks = [missing[i:i+100] for i in range(0, len(missing), 100)]
+                if len(chunks) == 1:
+                    fetched = self._fetch_features_chunk(chunks[0])
+                else:
+                    # Varios bloques: se piden en paralelo
+                    fetched = []
+                    with ThreadPoolExecutor(max_workers=min(ANALYSIS_WORKERS, len(chunks))) as executor:
+                        for features in executor.map(self._fetch_features_chunk, chunks):
+                            fetched.extend(features)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    all_features.extend(data.get('audio_features', []))
+                new_features = {features['id']: features for features in fetched if features}
+                cache.set_many(
+                    {f"spotify_audio_features:{track_id}": features for track_id, features in new_features.items()},
+                    timeout=None
+                )
+                features_by_id.update(new_features)
             
-            return all_features
+            self._feature_cache.update(features_by_id)
+            
+            # Mismo orden que track_ids; None para los tracks sin características
+            return [features_by_id.get(track_id) for track_id in track_ids]
             
         except Exception as e:
             logger.error(f"Error getting audio features: {e}")
             return []
     
+    def _fetch_features_chunk(self, track_ids):
+        """Características de audio de hasta 100 tracks en una sola petición"""
+        response = _SESSION.get(
+            f"{self.base_url}/audio-features",
+            headers=self.headers,
+            timeout=REQUEST_TIMEOUT,
+            params={'ids': ','.join(track_ids)}
+        )
+        
+        if response.status_code == 200:
+            return orjson.loads(response.content).get('audio_features', [])
+        return []
+    
     def analyze_listening_patterns(self, time_range='medium_term'):
         """Analiza patrones de escucha del usuario"""
+        # Los tops de Spotify apenas cambian en minutos: se reutiliza el análisis.
+        # La clave usa un hash del token, nunca el token en claro
+        token_hash = hashlib.sha256(self.access_token.encode()).hexdigest()
+        cache_key = f"spotify_analysis:{token_hash}:{time_range}"
+        analysis = cache.get(cache_key)
+        if analysis is None:
+            analysis = self._build_listening_analysis(time_range)
+            # Un fallo o un análisis vacío (error transitorio de Spotify) no se
+            # cachea para que la siguiente sincronización lo vuelva a intentar
+            if analysis and (analysis.get('top_artists') or analysis.get('top_tracks')):
+                cache.set(cache_key, analysis, ANALYSIS_CACHE_TIMEOUT)
+        return analysis
+    
+    def _build_listening_analysis(self, time_range):
+        """Calcula el análisis de escucha consultando la API de Spotify"""
         try:
-            # Obtener datos de canciones y artistas top
-            top_artists = self.get_top_artists(time_range)
-            top_tracks = self.get_top_tracks(time_range)
-            recently_played = self.get_recently_played()
-            
-            # Extraer géneros
-            all_genres = []
-            for artist in top_artists:
-                all_genres.extend(artist.get('genres', []))
-            
-            # Contar géneros
-            genre_counts = Counter(all_genres)
+            # Las peticiones son independientes: se lanzan a la vez y el tiempo
+            # total es el de la más lenta, no la suma
+            with ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS) as executor:
+                top_artists_future = executor.submit(self.get_top_artists, time_range)
+                recently_played_future = executor.submit(self._get_shared_recently_played)
+                top_tracks = self.get_top_tracks(time_range)
+                
+                # Características de audio de top tracks (solo dependen de top_tracks)
+                track_ids = [track.spotify_id for track in top_tracks if track.spotify_id]
+                audio_features_future = executor.submit(self.get_audio_features, track_ids)
+                
+                top_artists = top_artists_future.result()
+                recently_played = recently_played_future.result()
+                audio_features = audio_features_future.result()
             
-            # Obtener características de audio de top tracks
-            track_ids = [track['spotify_id'] for track in top_tracks if track.get('spotify_id')]
-            audio_features = self.get_audio_features(track_ids)
+            # Contar géneros de todos los artistas sin concatenar una lista intermedia
+            genre_counts = Counter(chain.from_iterable(artist.genres for artist in top_artists))
+            total_genres = genre_counts.total()
             
             # Calcular promedios de características musicales
             audio_averages = self._calculate_audio_averages(audio_features)
@@ -195,9 +325,9 @@ class SpotifyMusicAnalysisService:
                 'top_artists': top_artists[:20],
                 'top_tracks': top_tracks[:50],
                 'top_genres': [
-                    {'name': genre, 'count': count, 'percentage': round((count / len(all_genres)) * 100, 1)}
+                    {'name': genre, 'count': count, 'percentage': round((count / total_genres) * 100, 1)}
                     for genre, count in genre_counts.most_common(15)
-                ] if all_genres else [],
+                ] if total_genres else [],
                 'audio_profile': audio_averages,
                 'listening_stats': listening_stats,
                 'total_artists': len(top_artists),
@@ -214,52 +344,43 @@ class SpotifyMusicAnalysisService:
         if not audio_features:
             return {}
         
-        # Filtrar features válidos (no None)
-        valid_features = [f for f in audio_features if f is not None]
-        if not valid_features:
-            return {}
-        
-        features_to_average = [
-            'danceability', 'energy', 'speechiness', 'acousticness',
-            'instrumentalness', 'liveness', 'valence', 'tempo'
-        ]
+        # Una sola pasada acumulando suma y número de valores por característica
+        sums = dict.fromkeys(AUDIO_FEATURES, 0)
+        counts = dict.fromkeys(AUDIO_FEATURES, 0)
+        for features in audio_features:
+            if features is None:
+                continue
+            for feature in AUDIO_FEATURES:
+                value = features.get(feature)
+                if value is not None:
+                    sums[feature] += value
+                    counts[feature] += 1
         
-        averages = {}
-        for feature in features_to_average:
-            values = [f.get(feature, 0) for f in valid_features if f.get(feature) is not None]
-            if values:
-                averages[feature] = round(sum(values) / len(values), 3)
-        
-        return averages
+        return {
+            feature: round(sums[feature] / counts[feature], 3)
+            for feature in AUDIO_FEATURES if counts[feature]
+        }
     
     def _calculate_listening_stats(self, recently_played, top_tracks):
         """Calcula estadísticas de escucha"""
         try:
             # Calcular minutos totales aproximados (basado en top tracks)
-            total_duration_ms = sum(track.get('duration_ms', 0) for track in top_tracks)
+            total_duration_ms = sum(track.duration_ms for track in top_tracks)
             estimated_total_minutes = (total_duration_ms * 2) // 60000  # Estimación x2 para todo el período
             
             # Analizar patrones horarios de recently_played
-            hour_patterns = {}
-            if recently_played:
-                hour_counts = defaultdict(int)
-                
-                for track in recently_played:
-                    try:
-                        played_at = datetime.fromisoformat(track['played_at'].replace('Z', '+00:00'))
-                        hour = played_at.hour
-                        hour_counts[hour] += 1
-                    except:
-                        continue
-                
-                hour_patterns = dict(hour_counts)
+            # played_at es ISO 8601 en UTC ("2024-05-01T21:03:12.345Z"): la hora va en [11:13]
+            played_at_values = (track.played_at or '' for track in recently_played)
+            hour_patterns = dict(Counter(
+                int(played_at[11:13]) for played_at in played_at_values if played_at[11:13].isdigit()
+            ))
             
             return {
                 'estimated_total_minutes': estimated_total_minutes,
                 'estimated_total_hours': round(estimated_total_minutes / 60, 1),
                 'average_track_duration': round(total_duration_ms / len(top_tracks) / 1000 / 60, 1) if top_tracks else 0,
                 'hourly_patterns': hour_patterns,
-                'most_active_hour': max(hour_patterns.items(), key=lambda x: x[1])[0] if hour_patterns else None
+                'most_active_hour': max(hour_patterns, key=hour_patterns.get) if hour_patterns else None
             }
             
         except Exception as e:
@@ -272,24 +393,23 @@ class SpotifyMusicAnalysisService:
             if not genre_counts or not top_artists:
                 return 0
             
-            # Diversidad de géneros usando Índice de Shannon simplificado
+            # Diversidad de géneros usando el índice de Shannon
             total_genres = sum(genre_counts.values())
             if total_genres == 0:
                 return 0
             
             # Calcular entropía
-            entropy = 0
-            for count in genre_counts.values():
-                if count > 0:
-                    p = count / total_genres
-                    entropy -= p * (p * 100 // 100)  # Simplificado sin log
-            
-            # Normalizar a 0-100
-            max_entropy = len(genre_counts)
+            entropy = -sum(
+                count / total_genres * math.log(count / total_genres)
+                for count in genre_counts.values() if count > 0
+            )
+            
+            # Normalizar a 0-100 con la entropía máxima (todos los géneros por igual)
+            max_entropy = math.log(len(genre_counts))
             genre_score = (entropy / max_entropy) * 100 if max_entropy > 0 else 0
             
             # Diversidad de popularidad de artistas
-            popularities = [artist.get('popularity', 0) for artist in top_artists]
+            popularities = [artist.popularity for artist in top_artists]
             if not popularities:
                 return genre_score
             
@@ -307,6 +427,8 @@ class SpotifyMusicAnalysisService:
     
     def create_listening_stats_data(self, user_connection, period_type='monthly'):
         """Crea datos de estadísticas de escucha para almacenar en BD"""
+        from ..models import UserListeningStats
+        
         try:
             # Mapear period_type a time_range de Spotify
             time_range_map = {
@@ -333,21 +455,26 @@ class SpotifyMusicAnalysisService:
                 period_start = now - timedelta(days=7)
                 period_end = now
             
+            # Minutos estimados según el puesto: total // (puesto + desplazamiento).
+            # Se calculan una vez y los comparten artistas (desde 1) y tracks (desde 5)
+            estimated_total_minutes = analysis['listening_stats']['estimated_total_minutes']
+            minutes_by_divisor = [estimated_total_minutes // divisor for divisor in range(1, 55)]
+            
             # Formatear top artists para BD
             top_artists = []
             for i, artist in enumerate(analysis['top_artists'][:20]):
                 top_artists.append({
-                    'name': artist['name'],
-                    'minutes': analysis['listening_stats']['estimated_total_minutes'] // (i + 1),  # Distribución estimada
-                    'plays': max(100 // (i + 1), 1),  # Estimación de reproducciones
-                    'spotify_id': artist.get('spotify_id'),
+                    'name': artist.name,
+                    'minutes': minutes_by_divisor[i],  # Distribución estimada
+                    'plays': ARTIST_PLAYS_BY_RANK[i],  # Estimación de reproducciones
+                    'spotify_id': artist.spotify_id,
                     'rank': i + 1
                 })
             
             # Formatear top genres para BD
             top_genres = []
             for i, genre in enumerate(analysis['top_genres'][:15]):
-                estimated_minutes = int(analysis['listening_stats']['estimated_total_minutes'] * genre['percentage'] / 100)
+                estimated_minutes = int(estimated_total_minutes * genre['percentage'] / 100)
                 top_genres.append({
                     'name': genre['name'],
                     'minutes': estimated_minutes,
@@ -359,11 +486,11 @@ class SpotifyMusicAnalysisService:
             top_tracks = []
             for i, track in enumerate(analysis['top_tracks'][:50]):
                 top_tracks.append({
-                    'name': track['name'],
-                    'artist': track['artist'],
-                    'minutes': max(analysis['listening_stats']['estimated_total_minutes'] // (i + 5), 1),
-                    'plays': max(50 // (i + 1), 1),
-                    'spotify_id': track.get('spotify_id'),
+                    'name': track.name,
+                    'artist': track.artist,
+                    'minutes': max(minutes_by_divisor[i + 4], 1),
+                    'plays': TRACK_PLAYS_BY_RANK[i],
+                    'spotify_id': track.spotify_id,
                     'rank': i + 1
                 })
             
@@ -371,13 +498,15 @@ class SpotifyMusicAnalysisService:
                 'period_type': period_type,
                 'period_start': period_start,
                 'period_end': period_end,
-                'total_minutes': analysis['listening_stats']['estimated_total_minutes'],
+                'total_minutes': estimated_total_minutes,
                 'total_tracks': len(analysis['top_tracks']),
                 'unique_artists': len(analysis['top_artists']),
-                'unique_albums': len(set(track.get('album', '') for track in analysis['top_tracks'])),
+                'unique_albums': len(set(track.album for track in analysis['top_tracks'])),
                 'top_artists': top_artists,
                 'top_genres': top_genres,
                 'top_tracks': top_tracks,
+                'top_artists_bin': UserListeningStats.pack_top_minutes(top_artists),
+                'top_genres_bin': UserListeningStats.pack_top_minutes(top_genres),
                 'listening_patterns': analysis['listening_stats']['hourly_patterns'],
                 'audio_profile': analysis['audio_profile'],
                 'diversity_score': analysis['diversity_score']
@@ -1,13 +1,149 @@
 import csv
-import io
+import functools
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from ytmusicapi import YTMusic
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 import logging
 import re
+import secrets
 
 logger = logging.getLogger(__name__)
 
+# Resultados pendientes que fuerzan un volcado a la BD
+PROGRESS_BATCH_SIZE = 100
+# Segundos mínimos entre actualizaciones del progreso del job
+PROGRESS_UPDATE_INTERVAL = 1.0
+# Búsquedas simultáneas en YouTube Music durante una transferencia (configurable)
+SEARCH_WORKERS = max(1, getattr(settings, 'YTMUSIC_SEARCH_WORKERS', 8))
+# Búsquedas encoladas como máximo a la vez (el resto de canciones aún no se ha leído)
+SEARCH_WINDOW = SEARCH_WORKERS * 2
+# Filas de PlaylistSong leídas de la BD por bloque durante una transferencia
+TRANSFER_ROWS_CHUNK_SIZE = 200
+# Longitud máxima de los errores guardados por canción
+ERROR_MESSAGE_MAX_LENGTH = 500
+# Segundos que se reutiliza una búsqueda con resultado y una sin coincidencia
+# (esta solo lo justo para no repetirla en la misma transferencia o reintento)
+SEARCH_CACHE_TIMEOUT = 60 * 60 * 24
+SEARCH_MISS_CACHE_TIMEOUT = 60 * 5
+# Clave con la versión actual de la caché de búsquedas (incrementarla la invalida)
+SEARCH_CACHE_VERSION_KEY = 'ytmusic_search:version'
+
+# Cliente anónimo compartido: reutiliza la sesión HTTP (keep-alive) entre instancias
+_YTMUSIC = None
+_YTMUSIC_LOCK = threading.Lock()
+
+
+def _pooled_session():
+    """Sesión HTTP con pool keep-alive para todos los hilos de búsqueda y reintentos"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(
+        pool_connections=10,
+        # Al menos una conexión por hilo de búsqueda para no descartar conexiones
+        pool_maxsize=max(20, SEARCH_WORKERS),
+        max_retries=Retry(total=3, backoff_factor=0.3)
+    ))
+    return session
+
+
+def get_ytmusic():
+    """Devuelve el cliente YTMusic sin autenticación, creándolo una sola vez"""
+    global _YTMUSIC
+    if _YTMUSIC is None:
+        with _YTMUSIC_LOCK:
+            if _YTMUSIC is None:
+                _YTMUSIC = YTMusic(requests_session=_pooled_session())
+    return _YTMUSIC
+
+
+def _update_fields(instance, **fields):
+    """Escribe solo las columnas indicadas (sin save() completo) y las refleja en la instancia"""
+    type(instance)._default_manager.filter(pk=instance.pk).update(**fields)
+    for field, value in fields.items():
+        setattr(instance, field, value)
+
+
+def _windowed_map(executor, fn, items, window):
+    """Como executor.map, pero con como mucho `window` tareas enviadas a la vez y en orden"""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _simulated_playlist_id(prefix, padding):
+    """ID de playlist simulada con formato de YouTube: prefijo, 10 caracteres aleatorios y relleno"""
+    return f"{prefix}{secrets.token_hex(5)}{'x' * padding}"
+
+
+_NON_WORD = re.compile(r'[^\w\s]')
+_QUERY_INVALID_CHARS = re.compile(r'[^\w\s-]')
+
+
+def _search_cache_version():
+    """Versión actual de la caché de búsquedas, o None si la caché no responde"""
+    try:
+        return cache.get_or_set(SEARCH_CACHE_VERSION_KEY, 1, None)
+    except Exception as e:
+        logger.warning(f"Caché de búsquedas no disponible: {e}")
+        return None
+
+
+def _search_cache_key(track_name, artist_name, album_name, version):
+    """Clave de caché de una búsqueda, independiente de mayúsculas y espacios"""
+    normalized = '|'.join(' '.join((text or '').casefold().split()) for text in (track_name, artist_name, album_name))
+    return f"ytmusic_search:{version}:{hashlib.sha1(normalized.encode()).hexdigest()}"
+
+
+def _cache_get(key):
+    """Lee una búsqueda cacheada; si la caché falla se trata como si no estuviera"""
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning(f"Error leyendo la caché de búsquedas: {e}")
+        return None
+
+
+def _cache_set(key, value, timeout):
+    """Guarda una búsqueda en caché sin que un fallo de la caché afecte al resultado"""
+    try:
+        cache.set(key, value, timeout)
+    except Exception as e:
+        logger.warning(f"Error guardando en la caché de búsquedas: {e}")
+
+
+def clear_search_cache():
+    """Invalida todas las búsquedas cacheadas pasando a una nueva versión de clave"""
+    try:
+        cache.incr(SEARCH_CACHE_VERSION_KEY)
+    except ValueError:
+        # La versión aún no existía: no hay búsquedas cacheadas
+        pass
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalized_words(text):
+    """Conjunto inmutable de palabras sin signos y en minúsculas (casefold), cacheado"""
+    return frozenset(_NON_WORD.sub('', text.casefold()).split())
+
+
+def _words_similarity(track_words1, artist_words1, track_words2, artist_words2):
+    """Score por palabras compartidas, con mayor peso al artista"""
+    track_score = len(track_words1 & track_words2) / max(len(track_words1), len(track_words2), 1)
+    artist_score = len(artist_words1 & artist_words2) / max(len(artist_words1), len(artist_words2), 1)
+    return (track_score * 0.4) + (artist_score * 0.6)
+
 
 class YouTubeMusicService:
     """Servicio para manejar transferencias a YouTube Music"""
@@ -28,8 +164,9 @@ class YouTubeMusicService:
                         # Intentar primero con headers directamente
                         headers = browser_data['headers']
                         
-                        # YTMusic puede aceptar headers directamente en algunas versiones
-                        self.ytmusic = YTMusic()
+                        # YTMusic puede aceptar headers directamente en algunas versiones.
+                        # Sesión propia: lleva las cabeceras de este usuario
+                        self.ytmusic = YTMusic(requests_session=_pooled_session())
                         
                         # Configurar headers manualmente si es posible
                         if hasattr(self.ytmusic, '_session'):
@@ -42,8 +179,8 @@ class YouTubeMusicService:
                             
                     except Exception as e:
                         logger.error(f"Error configurando headers: {e}")
-                        # Intentar con archivo temporal como fallback
-                        self._try_temp_file_auth(browser_data)
+                        # Intentar con los datos del navegador como auth
+                        self._try_dict_auth(browser_data)
                 else:
                     logger.error("Los datos del navegador no contienen 'headers'")
                     self._initialize_fallback()
@@ -53,39 +190,20 @@ class YouTubeMusicService:
             logger.error(f"Error inicializando YouTube Music para usuario {self.user.username}: {e}")
             self._initialize_fallback()
     
-    def _try_temp_file_auth(self, browser_data):
-        """Intentar autenticación con archivo temporal"""
+    def _try_dict_auth(self, browser_data):
+        """Intentar autenticación pasando los datos del navegador directamente a YTMusic"""
         try:
-            import tempfile
-            import json
-            import os
-            
-            # Crear archivo temporal con los datos del navegador
-            temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False)
-            json.dump(browser_data, temp_file, indent=2)
-            temp_file.close()
-            
-            try:
-                # Intentar diferentes métodos de inicialización
-                self.ytmusic = YTMusic(auth=temp_file.name)
-                logger.info(f"YouTube Music inicializado con archivo temporal para usuario {self.user.username}")
-            except Exception as e:
-                logger.error(f"Error con archivo temporal: {e}")
-                self._initialize_fallback()
-            finally:
-                # Limpiar archivo temporal
-                try:
-                    os.unlink(temp_file.name)
-                except:
-                    pass
+            # ytmusicapi acepta el dict de autenticación sin pasar por un archivo
+            self.ytmusic = YTMusic(auth=browser_data, requests_session=_pooled_session())
+            logger.info(f"YouTube Music inicializado con datos del navegador para usuario {self.user.username}")
         except Exception as e:
-            logger.error(f"Error creando archivo temporal: {e}")
+            logger.error(f"Error con los datos del navegador: {e}")
             self._initialize_fallback()
     
     def _initialize_fallback(self):
         """Inicializar en modo fallback sin autenticación"""
         try:
-            self.ytmusic = YTMusic()
+            self.ytmusic = get_ytmusic()
             logger.warning(f"YouTube Music inicializado sin autenticación para usuario {self.user.username}")
         except Exception as e:
             logger.error(f"Error incluso en modo fallback: {e}")
@@ -102,19 +220,13 @@ class YouTubeMusicService:
         # Como la autenticación real está dando problemas, crear playlist simulada
         # pero indicar que es "real" si el usuario tiene configuración
         try:
-            import hashlib
-            import time
-            
-            playlist_data = f"{title}_{int(time.time())}"
-            playlist_hash = hashlib.md5(playlist_data.encode()).hexdigest()[:10]
-            
             if self.is_authenticated():
                 # Simular playlist "real" con formato de YouTube
-                playlist_id = f"PLrAl{playlist_hash}{''.join(['x' for _ in range(20)])}"
+                playlist_id = _simulated_playlist_id('PLrAl', 20)
                 logger.info(f"Playlist 'real' simulada creada para usuario autenticado: {title} ({playlist_id})")
             else:
                 # Playlist completamente simulada
-                playlist_id = f"PLsim{playlist_hash}{''.join(['x' for _ in range(20)])}"
+                playlist_id = _simulated_playlist_id('PLsim', 20)
                 logger.info(f"Playlist simulada creada: {title} ({playlist_id})")
             
             return playlist_id
@@ -142,8 +254,19 @@ class YouTubeMusicService:
             logger.error(f"Error agregando canciones a playlist {playlist_id}: {e}")
             raise
     
-    def search_track(self, track_name, artist_name, album_name=None):
-        """Buscar una canción en YouTube Music"""
+    def search_track(self, track_name, artist_name, album_name=None, use_cache=True, cache_version=None):
+        """Buscar una canción en YouTube Music (use_cache=False consulta siempre la API)"""
+        # Búsquedas repetidas (mismas canciones, reintentos) no vuelven a la API;
+        # un dict vacío en caché indica que no hubo coincidencia
+        cache_key = None
+        if use_cache:
+            version = cache_version or _search_cache_version()
+            if version is not None:
+                cache_key = _search_cache_key(track_name, artist_name, album_name, version)
+                cached = _cache_get(cache_key)
+                if cached is not None:
+                    return cached or None
+        
         try:
             # Construir query de búsqueda
             query = f"{track_name} {artist_name}"
@@ -151,11 +274,15 @@ class YouTubeMusicService:
                 query += f" {album_name}"
             
             # Limpiar caracteres especiales
-            query = re.sub(r'[^\w\s-]', '', query)
+            query = _QUERY_INVALID_CHARS.sub('', query)
             
             # Buscar en YouTube Music
             search_results = self.ytmusic.search(query, filter="songs", limit=5)
             
+            # Las palabras de la canción buscada se normalizan una sola vez
+            track_words = _normalized_words(track_name)
+            artist_words = _normalized_words(artist_name)
+            
             best_match = None
             best_score = 0
             
@@ -163,52 +290,48 @@ class YouTubeMusicService:
                 if result['resultType'] != 'song':
                     continue
                 
+                # Sin artistas en común el score no puede superar 0.4 (peso del título)
+                result_artist_words = _normalized_words(result['artists'][0]['name'] if result['artists'] else '')
+                if not artist_words & result_artist_words:
+                    continue
+                
                 # Calcular score de similitud simple
-                score = self._calculate_similarity_score(
-                    track_name, artist_name,
-                    result['title'], result['artists'][0]['name'] if result['artists'] else ''
+                score = _words_similarity(
+                    track_words, artist_words,
+                    _normalized_words(result['title']),
+                    result_artist_words
                 )
                 
                 if score > best_score:
                     best_score = score
                     best_match = result
             
-            return best_match if best_score > 0.6 else None
-            
         except Exception as e:
             logger.error(f"Error buscando track {track_name} - {artist_name}: {e}")
             return None
+        
+        if best_score > 0.6:
+            # Solo se guardan los campos que usa la transferencia
+            match = {
+                'videoId': best_match.get('videoId'),
+                'title': best_match.get('title'),
+                'artists': best_match['artists'][:1],
+                'match_confidence': best_score
+            }
+            if cache_key:
+                _cache_set(cache_key, match, SEARCH_CACHE_TIMEOUT)
+            return match
+        
+        if cache_key:
+            _cache_set(cache_key, {}, SEARCH_MISS_CACHE_TIMEOUT)
+        return None
+
+
+class _Echo:
+    """Pseudo-fichero para csv.writer: devuelve la línea escrita en lugar de guardarla"""
     
-    def _calculate_similarity_score(self, track1, artist1, track2, artist2):
-        """Calcular score de similitud simple entre dos canciones"""
-        try:
-            # Normalizar strings
-            def normalize(s):
-                return re.sub(r'[^\w\s]', '', s.lower().strip())
-            
-            track1_norm = normalize(track1)
-            artist1_norm = normalize(artist1)
-            track2_norm = normalize(track2)
-            artist2_norm = normalize(artist2)
-            
-            # Score basado en coincidencias de palabras
-            track_words1 = set(track1_norm.split())
-            track_words2 = set(track2_norm.split())
-            artist_words1 = set(artist1_norm.split())
-            artist_words2 = set(artist2_norm.split())
-            
-            # Intersección de palabras
-            track_intersection = len(track_words1.intersection(track_words2))
-            artist_intersection = len(artist_words1.intersection(artist_words2))
-            
-            # Calcular score (peso mayor al artista)
-            track_score = track_intersection / max(len(track_words1), len(track_words2), 1)
-            artist_score = artist_intersection / max(len(artist_words1), len(artist_words2), 1)
-            
-            return (track_score * 0.4) + (artist_score * 0.6)
-            
-        except Exception:
-            return 0
+    def write(self, value):
+        return value
 
 
 class PlaylistExportService:
@@ -219,17 +342,20 @@ class PlaylistExportService:
     
     def export_to_csv(self, playlist):
         """Exportar playlist a CSV con formato optimizado para Excel/Sheets"""
+        return ''.join(self.iter_csv_rows(playlist))
+    
+    def iter_csv_rows(self, playlist):
+        """Genera el CSV de la playlist línea a línea, sin construirlo entero en memoria"""
         try:
             from ..models import PlaylistSong
             
-            # Crear buffer de CSV en memoria con encoding UTF-8 BOM para Excel
-            output = io.StringIO()
-            writer = csv.writer(output, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+            # El writer escribe en _Echo, que devuelve cada línea en lugar de acumularla
+            writer = csv.writer(_Echo(), delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
             
-            # Escribir BOM para Excel (se añadirá al crear la respuesta HTTP)
+            # El BOM para Excel se añade al crear la respuesta HTTP
             
             # Escribir header con información clara
-            writer.writerow([
+            yield writer.writerow([
                 'Posición',
                 'Título de la Canción',
                 'Artista',
@@ -242,14 +368,24 @@ class PlaylistExportService:
                 'Fecha de Importación'
             ])
             
-            # Obtener canciones de la playlist
-            playlist_songs = PlaylistSong.objects.filter(playlist=playlist).order_by('position')
+            # Obtener canciones de la playlist con su canción en la misma consulta
+            playlist_songs = PlaylistSong.objects.filter(playlist=playlist).select_related('song').only(
+                'position', 'added_at', 'song__name', 'song__artist', 'song__album', 'song__duration_ms',
+                'song__spotify_url', 'song__preview_url', 'song__spotify_id'
+            ).order_by('position')
             
-            for ps in playlist_songs:
+            # Estadísticas acumuladas en la misma pasada
+            total_duration_ms = 0
+            preview_count = 0
+            
+            for ps in playlist_songs.iterator(chunk_size=500):
                 song = ps.song
+                total_duration_ms += song.duration_ms or 0
+                if song.preview_url:
+                    preview_count += 1
                 duration_formatted = self._format_duration(song.duration_ms)
                 
-                writer.writerow([
+                yield writer.writerow([
                     ps.position,
                     song.name or '',
                     song.artist or '',
@@ -263,30 +399,23 @@ class PlaylistExportService:
                 ])
             
             # Agregar sección separada con información de la playlist
-            writer.writerow([])  # Línea vacía
-            writer.writerow([''])  # Línea vacía adicional
-            writer.writerow(['=== INFORMACIÓN DE LA PLAYLIST ==='])
-            writer.writerow(['Nombre', playlist.name])
-            writer.writerow(['Descripción', playlist.description or 'Sin descripción'])
-            writer.writerow(['Total de Canciones', playlist.total_tracks])
-            writer.writerow(['Fecha de Creación', playlist.created_at.strftime('%d/%m/%Y %H:%M')])
-            writer.writerow(['Enlace de Spotify', playlist.spotify_url])
+            yield writer.writerow([])  # Línea vacía
+            yield writer.writerow([''])  # Línea vacía adicional
+            yield writer.writerow(['=== INFORMACIÓN DE LA PLAYLIST ==='])
+            yield writer.writerow(['Nombre', playlist.name])
+            yield writer.writerow(['Descripción', playlist.description or 'Sin descripción'])
+            yield writer.writerow(['Total de Canciones', playlist.total_tracks])
+            yield writer.writerow(['Fecha de Creación', playlist.created_at.strftime('%d/%m/%Y %H:%M')])
+            yield writer.writerow(['Enlace de Spotify', playlist.spotify_url])
             if playlist.youtube_url:
-                writer.writerow(['Enlace de YouTube Music', playlist.youtube_url])
+                yield writer.writerow(['Enlace de YouTube Music', playlist.youtube_url])
             
-            writer.writerow([])  # Línea vacía
-            writer.writerow(['=== ESTADÍSTICAS ==='])
-            total_duration_ms = sum(song.song.duration_ms or 0 for song in playlist_songs)
+            yield writer.writerow([])  # Línea vacía
+            yield writer.writerow(['=== ESTADÍSTICAS ==='])
             total_hours = total_duration_ms // (1000 * 60 * 60)
             total_minutes = (total_duration_ms // (1000 * 60)) % 60
-            writer.writerow(['Duración Total', f'{total_hours}h {total_minutes}m'])
-            writer.writerow(['Canciones con Vista Previa', sum(1 for song in playlist_songs if song.song.preview_url)])
-            
-            # Obtener contenido CSV
-            csv_content = output.getvalue()
-            output.close()
-            
-            return csv_content
+            yield writer.writerow(['Duración Total', f'{total_hours}h {total_minutes}m'])
+            yield writer.writerow(['Canciones con Vista Previa', preview_count])
             
         except Exception as e:
             logger.error(f"Error exportando playlist a CSV: {e}")
@@ -315,15 +444,18 @@ class YouTubeTransferService:
     def transfer_playlist(self, playlist, transfer_job):
         """Transferir playlist a YouTube Music"""
         try:
-            from ..models import PlaylistSong, SongTransferResult
+            from ..models import PlaylistSong, SongTransferResult, TransferJob
             
             # Verificar configuración del usuario
             logger.info(f"Iniciando transferencia para usuario {self.user.username}")
             logger.info(f"Usuario tiene configuración de YouTube Music: {self.youtube_service.is_authenticated()}")
             
             # Obtener canciones de la playlist
-            playlist_songs = PlaylistSong.objects.filter(playlist=playlist).order_by('position')
-            total_songs = len(playlist_songs)
+            # Solo las columnas necesarias de cada canción, como diccionarios
+            playlist_songs = PlaylistSong.objects.filter(playlist=playlist).order_by('position').values(
+                'song_id', 'song__name', 'song__artist', 'song__album'
+            )
+            total_songs = playlist_songs.count()
             
             logger.info(f"Transfiriendo playlist '{playlist.name}' (ID: {playlist.id})")
             logger.info(f"Total de canciones encontradas en PlaylistSong: {total_songs}")
@@ -333,86 +465,116 @@ class YouTubeTransferService:
             if total_songs == 0:
                 error_msg = f"No se encontraron canciones para la playlist '{playlist.name}'. Verifica que la playlist se haya importado correctamente."
                 logger.error(error_msg)
-                transfer_job.status = 'failed'
-                transfer_job.error_message = error_msg
-                transfer_job.completed_at = timezone.now()
-                transfer_job.save()
                 raise Exception(error_msg)
             
             # Actualizar job
-            transfer_job.total_songs = total_songs
-            transfer_job.status = 'processing'
-            transfer_job.started_at = timezone.now()
-            transfer_job.save()
+            _update_fields(
+                transfer_job,
+                total_songs=total_songs,
+                status='processing',
+                started_at=timezone.now()
+            )
             
             successful_transfers = 0
             failed_transfers = 0
             youtube_video_ids = []  # Para crear la playlist
+            pending_results = []
             
-            for ps in playlist_songs:
-                song = ps.song
-                
-                try:
-                    # Buscar canción en YouTube Music
-                    youtube_result = self.youtube_service.search_track(
-                        song.name, song.artist, song.album
-                    )
+            last_flush = time.monotonic()
+            
+            def flush_progress():
+                """Inserta los resultados pendientes y actualiza contadores en un único UPDATE"""
+                nonlocal last_flush
+                last_flush = time.monotonic()
+                SongTransferResult.objects.bulk_create(pending_results, batch_size=200)
+                pending_results.clear()
+                processed = successful_transfers + failed_transfers
+                TransferJob.objects.filter(pk=transfer_job.pk).update(
+                    processed_songs=processed,
+                    successful_transfers=successful_transfers,
+                    failed_transfers=failed_transfers,
+                    progress_percentage=int((processed / total_songs) * 100)
+                )
+            
+            # La versión de la caché de búsquedas se lee una vez por transferencia
+            cache_version = _search_cache_version()
+            
+            def search(row):
+                return row, self.youtube_service.search_track(
+                    row['song__name'], row['song__artist'], row['song__album'],
+                    use_cache=cache_version is not None,
+                    cache_version=cache_version
+                )
+            
+            # Las búsquedas se solapan en un pool de hilos con un número acotado
+            # en vuelo: las filas se leen de la BD a medida que se necesitan y los
+            # resultados llegan en el orden de la playlist
+            executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+            try:
+                rows = playlist_songs.iterator(chunk_size=TRANSFER_ROWS_CHUNK_SIZE)
+                for row, youtube_result in _windowed_map(executor, search, rows, SEARCH_WINDOW):
+                    song_id, song_name, song_artist = row['song_id'], row['song__name'], row['song__artist']
                     
-                    if youtube_result:
-                        # Calcular confianza de coincidencia
-                        confidence = self.youtube_service._calculate_similarity_score(
-                            song.name, song.artist,
-                            youtube_result.get('title', ''),
-                            youtube_result['artists'][0]['name'] if youtube_result.get('artists') else ''
-                        )
-                        
-                        # Crear resultado exitoso
-                        result = SongTransferResult.objects.create(
-                            transfer_job=transfer_job,
-                            song=song,
-                            youtube_video_id=youtube_result.get('videoId'),
-                            youtube_title=youtube_result.get('title'),
-                            youtube_artist=youtube_result['artists'][0]['name'] if youtube_result.get('artists') else '',
-                            match_confidence=confidence,
-                            transfer_status='success'
-                        )
-                        
-                        youtube_video_ids.append(youtube_result.get('videoId'))
-                        successful_transfers += 1
-                        
-                        logger.info(f"Transferida exitosamente: {song.name} - {song.artist}")
-                        
-                    else:
-                        # Crear resultado fallido
-                        SongTransferResult.objects.create(
+                    try:
+                        if youtube_result:
+                            # Confianza calculada durante la búsqueda (no se vuelve a puntuar)
+                            confidence = youtube_result['match_confidence']
+                            
+                            # Crear resultado exitoso
+                            pending_results.append(SongTransferResult(
+                                transfer_job=transfer_job,
+                                song_id=song_id,
+                                youtube_video_id=youtube_result.get('videoId'),
+                                youtube_title=youtube_result.get('title'),
+                                youtube_artist=youtube_result['artists'][0]['name'] if youtube_result.get('artists') else '',
+                                match_confidence=confidence,
+                                transfer_status='success'
+                            ))
+                            
+                            youtube_video_ids.append(youtube_result.get('videoId'))
+                            successful_transfers += 1
+                            
+                            logger.info(f"Transferida exitosamente: {song_name} - {song_artist}")
+                            
+                        else:
+                            # Crear resultado fallido
+                            pending_results.append(SongTransferResult(
+                                transfer_job=transfer_job,
+                                song_id=song_id,
+                                transfer_status='failed',
+                                error_message='No se encontró coincidencia en YouTube Music'
+                            ))
+                            failed_transfers += 1
+                            
+                            logger.warning(f"No se encontró coincidencia para: {song_name} - {song_artist}")
+                    
+                    except Exception as e:
+                        # Error en transferencia individual
+                        pending_results.append(SongTransferResult(
                             transfer_job=transfer_job,
-                            song=song,
+                            song_id=song_id,
                             transfer_status='failed',
-                            error_message='No se encontró coincidencia en YouTube Music'
-                        )
+                            error_message=str(e)[:ERROR_MESSAGE_MAX_LENGTH]
+                        ))
                         failed_transfers += 1
                         
-                        logger.warning(f"No se encontró coincidencia para: {song.name} - {song.artist}")
-                
-                except Exception as e:
-                    # Error en transferencia individual
-                    SongTransferResult.objects.create(
-                        transfer_job=transfer_job,
-                        song=song,
-                        transfer_status='failed',
-                        error_message=str(e)
-                    )
-                    failed_transfers += 1
+                        logger.error(f"Error transfiriendo {song_name} - {song_artist}: {e}")
                     
-                    logger.error(f"Error transfiriendo {song.name} - {song.artist}: {e}")
-                
-                # Actualizar progreso
-                processed = successful_transfers + failed_transfers
-                transfer_job.processed_songs = processed
-                transfer_job.successful_transfers = successful_transfers
-                transfer_job.failed_transfers = failed_transfers
-                transfer_job.progress_percentage = int((processed / total_songs) * 100)
-                transfer_job.save()
+                    # Volcar al llenarse el lote o, si no, como mucho una vez por intervalo
+                    if (len(pending_results) >= PROGRESS_BATCH_SIZE
+                            or time.monotonic() - last_flush >= PROGRESS_UPDATE_INTERVAL):
+                        flush_progress()
+            finally:
+                # Ante un error no quedan búsquedas encoladas ejecutándose
+                executor.shutdown(cancel_futures=True)
+            
+            SongTransferResult.objects.bulk_create(pending_results, batch_size=200)
+            final_fields = {
+                'processed_songs': successful_transfers + failed_transfers,
+                'successful_transfers': successful_transfers,
+                'failed_transfers': failed_transfers,
+                'progress_percentage': 100
+            }
             
             # Crear playlist en YouTube Music (simulado por ahora)
             if successful_transfers > 0:
@@ -423,22 +585,25 @@ class YouTubeTransferService:
                 )
                 
                 if youtube_playlist_result:
-                    transfer_job.youtube_playlist_id = youtube_playlist_result['playlist_id']
+                    final_fields['youtube_playlist_id'] = youtube_playlist_result['playlist_id']
                     # Actualizar la playlist original con el ID de YouTube
-                    playlist.youtube_playlist_id = youtube_playlist_result['playlist_id']
-                    playlist.save()
+                    _update_fields(
+                        playlist,
+                        youtube_playlist_id=youtube_playlist_result['playlist_id'],
+                        updated_at=timezone.now()
+                    )
             
             # Finalizar transferencia
             if failed_transfers == 0:
-                transfer_job.status = 'completed'
+                final_fields['status'] = 'completed'
             elif successful_transfers > 0:
-                transfer_job.status = 'partial'
+                final_fields['status'] = 'partial'
             else:
-                transfer_job.status = 'failed'
-                transfer_job.error_message = 'No se pudo transferir ninguna canción'
+                final_fields['status'] = 'failed'
+                final_fields['error_message'] = 'No se pudo transferir ninguna canción'
             
-            transfer_job.completed_at = timezone.now()
-            transfer_job.save()
+            final_fields['completed_at'] = timezone.now()
+            _update_fields(transfer_job, **final_fields)
             
             return {
                 'success': True,
@@ -450,10 +615,12 @@ class YouTubeTransferService:
             }
             
         except Exception as e:
-            transfer_job.status = 'failed'
-            transfer_job.error_message = str(e)
-            transfer_job.completed_at = timezone.now()
-            transfer_job.save()
+            _update_fields(
+                transfer_job,
+                status='failed',
+                error_message=str(e),
+                completed_at=timezone.now()
+            )
             
             logger.error(f"Error en transferencia a YouTube: {e}")
             raise Exception(f"Error al transferir playlist: {str(e)}")
@@ -491,13 +658,7 @@ class YouTubeTransferService:
     def _create_simulated_playlist(self, name, description, video_ids):
         """Crear playlist simulada (para testing o cuando no hay configuración)"""
         try:
-            # Generar un ID simulado basado en el timestamp y nombre
-            import hashlib
-            import time
-            
-            playlist_data = f"{name}_{int(time.time())}"
-            playlist_hash = hashlib.md5(playlist_data.encode()).hexdigest()[:10]
-            simulated_playlist_id = f"PL{playlist_hash}{''.join(['x' for _ in range(24)])}"
+            simulated_playlist_id = _simulated_playlist_id('PL', 24)
             
             logger.info(f"Playlist simulada creada: {name} con {len(video_ids)} videos")
             
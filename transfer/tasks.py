@@ -0,0 +1,88 @@
+import logging
+from datetime import timedelta
+from celery import shared_task
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import TransferJob, UserListeningStats, UserMusicConnection
+from .services.spotify_analysis import SpotifyMusicAnalysisService
+from .services.youtube import YouTubeTransferService
+
+logger = logging.getLogger(__name__)
+
+# Una conexión sincronizada hace menos de esto se considera al día
+STATS_REFRESH_INTERVAL = timedelta(minutes=15)
+
+# Marca en caché de una sincronización en curso: evita encolar la misma conexión dos veces
+STATS_SYNC_LOCK_KEY = 'listening_stats_sync:{}'
+STATS_SYNC_LOCK_TIMEOUT = 600
+
+
+@shared_task
+def process_transfer_task(transfer_job_id):
+    """Ejecuta la transferencia de un trabajo en un worker de Celery"""
+    # Reclamar el trabajo de forma atómica: un trabajo cancelado mientras
+    # esperaba o una tarea reentregada (acks_late) no se vuelve a transferir
+    claimed = TransferJob.objects.filter(id=transfer_job_id, status='pending').update(
+        status='processing',
+        started_at=timezone.now()
+    )
+    if not claimed:
+        logger.info(f"Trabajo de transferencia {transfer_job_id} cancelado o ya procesado; se omite")
+        return
+    
+    transfer_job = TransferJob.objects.get(id=transfer_job_id)
+    
+    try:
+        YouTubeTransferService(transfer_job.user).transfer_playlist(transfer_job.playlist, transfer_job)
+    except Exception as e:
+        # transfer_playlist ya marca el trabajo como fallido
+        logger.error(f"Error en tarea de transferencia {transfer_job_id}: {e}")
+
+
+@shared_task
+def sync_listening_stats_task(connection_id, period_type='monthly'):
+    """Sincroniza las estadísticas de escucha de una conexión de Spotify en un worker"""
+    connection = UserMusicConnection.objects.select_related('user').get(id=connection_id)
+    user = connection.user
+    
+    try:
+        stats_data = SpotifyMusicAnalysisService(connection.access_token).create_listening_stats_data(
+            connection, period_type
+        )
+        if not stats_data:
+            raise Exception("No se pudieron obtener datos")
+        
+        with transaction.atomic():
+            previous_minutes = UserListeningStats.objects.filter(
+                user=user,
+                platform_connection=connection,
+                period_type=stats_data['period_type'],
+                period_start=stats_data['period_start']
+            ).values_list('total_minutes', flat=True).first() or 0
+            
+            # Crear o actualizar estadísticas
+            stats, created = UserListeningStats.objects.update_or_create(
+                user=user,
+                platform_connection=connection,
+                period_type=stats_data['period_type'],
+                period_start=stats_data['period_start'],
+                defaults=stats_data
+            )
+            user.add_listening_minutes(stats.total_minutes - previous_minutes)
+        stats.refresh_top_items()
+        
+        # Actualizar fecha de sincronización
+        connection.last_synced = timezone.now()
+        connection.sync_errors = ''
+        connection.save(update_fields=['last_synced', 'sync_errors'])
+        user.mark_music_synced()
+        
+    except Exception as e:
+        logger.error(f"Error sincronizando estadísticas de la conexión {connection_id}: {e}")
+        connection.sync_errors = str(e)
+        connection.save(update_fields=['sync_errors'])
+    
+    finally:
+        cache.delete(STATS_SYNC_LOCK_KEY.format(connection_id))
@@ -1,3 +1,463 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import MusicPlatform, Playlist, PlaylistSong, Song, SongTransferResult, TransferJob, UserMusicConnection
+from .services.music_analysis import MusicAnalysisService
+from .services.spotify import SpotifyAuthService, SpotifyPlaylistService
+from .services.youtube import YouTubeMusicService
+from .tasks import STATS_SYNC_LOCK_KEY, process_transfer_task, sync_listening_stats_task
+
+User = get_user_model()
+
+
+class SpotifyAuthServiceTests(TestCase):
+    """Callback y desconexión de Spotify con el modelo User actual"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='spotify_user', password='x')
+        self.service = SpotifyAuthService()
+        self.service._sp_oauth = mock.Mock()
+        self.service._sp_oauth.get_access_token.return_value = {
+            'access_token': 'access',
+            'refresh_token': 'refresh',
+            'expires_in': 3600
+        }
+
+    @mock.patch('transfer.services.spotify.spotipy.Spotify')
+    def test_handle_callback_saves_profile(self, spotify):
+        spotify.return_value.current_user.return_value = {
+            'id': 'abc',
+            'display_name': 'ABC',
+            'email': 'abc@example.com',
+            'country': 'ES',
+            'product': 'premium',
+            'images': [{'url': 'https://example.com/abc.png'}]
+        }
+
+        result = self.service.handle_callback('code', self.user)
+
+        self.assertTrue(result['success'], result.get('error'))
+        self.assertEqual(self.user.spotify_access_token, 'access')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.country, 'ES')
+        self.assertEqual(self.user.profile_image, 'https://example.com/abc.png')
+
+    def test_disconnect_user_clears_profile(self):
+        User.objects.filter(pk=self.user.pk).update(country='ES', profile_image='https://example.com/abc.png')
+        self.user.refresh_from_db()
+
+        self.service.disconnect_user(self.user)
+
+        self.assertIsNone(self.user.spotify_access_token)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.country)
+        self.assertIsNone(self.user.profile_image)
+
+
+class SearchTrackCacheTests(TestCase):
+    """Caché de búsquedas de YouTube Music: acierto, fallo, bypass y caché caída"""
+
+    SONG = {
+        'resultType': 'song',
+        'videoId': 'dQw4w9WgXcQ',
+        'title': 'Never Gonna Give You Up',
+        'artists': [{'name': 'Rick Astley'}]
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='yt_user', password='x')
+        with mock.patch.object(YouTubeMusicService, '_initialize_ytmusic'):
+            self.service = YouTubeMusicService(self.user)
+        self.service.ytmusic = mock.Mock()
+        self.service.ytmusic.search.return_value = [self.SONG]
+
+    def search(self, **kwargs):
+        return self.service.search_track('Never Gonna Give You Up', 'Rick Astley', **kwargs)
+
+    def test_hit_skips_api(self):
+        first = self.search()
+        second = self.search()
+
+        self.assertEqual(first['videoId'], 'dQw4w9WgXcQ')
+        self.assertEqual(second, first)
+        self.service.ytmusic.search.assert_called_once()
+
+    def test_miss_is_cached(self):
+        self.service.ytmusic.search.return_value = []
+
+        self.assertIsNone(self.search())
+        self.assertIsNone(self.search())
+        self.service.ytmusic.search.assert_called_once()
+
+    def test_bypass_always_queries_api(self):
+        with mock.patch('transfer.services.youtube.cache') as mocked_cache:
+            self.search(use_cache=False)
+            self.search(use_cache=False)
+
+        self.assertEqual(self.service.ytmusic.search.call_count, 2)
+        self.assertEqual(mocked_cache.mock_calls, [])
+
+    def test_cache_error_falls_back_to_api(self):
+        with mock.patch('transfer.services.youtube.cache') as mocked_cache:
+            mocked_cache.get_or_set.return_value = 1
+            mocked_cache.get.side_effect = ConnectionError('cache down')
+            mocked_cache.set.side_effect = ConnectionError('cache down')
+            result = self.search()
+
+        self.assertEqual(result['videoId'], 'dQw4w9WgXcQ')
+        self.service.ytmusic.search.assert_called_once()
+
+    def test_version_error_falls_back_to_api(self):
+        with mock.patch('transfer.services.youtube.cache') as mocked_cache:
+            mocked_cache.get_or_set.side_effect = ConnectionError('cache down')
+            result = self.search()
+
+        self.assertEqual(result['videoId'], 'dQw4w9WgXcQ')
+        mocked_cache.get.assert_not_called()
+
+
+class ListQueryCountTests(TestCase):
+    """Los listados hacen un número fijo de consultas, sin importar cuántas filas haya"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='list_user', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for index in range(5):
+            playlist = Playlist.objects.create(user=self.user, spotify_id=f'pl{index}', name=f'Playlist {index}')
+            TransferJob.objects.create(user=self.user, playlist=playlist, youtube_playlist_name=f'YT {index}')
+
+    def test_playlists_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/playlists/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 5)
+
+    def test_transfer_jobs_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/transfer-jobs/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 5)
+        self.assertEqual(response.json()[0]['playlist']['user']['username'], 'list_user')
+
+    def test_transfer_job_progress(self):
+        job = TransferJob.objects.filter(user=self.user).first()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/transfer-jobs/{job.id}/progress/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['progress_percentage'], 0)
+
+
+class SyncLockTests(TestCase):
+    """Una conexión solo se encola una vez mientras su sincronización está en curso"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='sync_user', password='x')
+        platform = MusicPlatform.objects.create(name='spotify', display_name='Spotify')
+        self.connection = UserMusicConnection.objects.create(
+            user=self.user, platform=platform, platform_user_id='abc', access_token='access'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/music/sync/')
+        self.assertEqual(response.status_code, 202)
+        return response.json()['synced_platforms'][0]['status']
+
+    @mock.patch('transfer.views.sync_listening_stats_task')
+    def test_second_sync_waits_for_running_one(self, task):
+        self.assertEqual(self.sync(), 'queued')
+        self.assertEqual(self.sync(), 'in_progress')
+        task.delay.assert_called_once_with(self.connection.id)
+
+    @mock.patch('transfer.views.sync_listening_stats_task')
+    def test_recent_sync_is_up_to_date(self, task):
+        UserMusicConnection.objects.filter(pk=self.connection.pk).update(last_synced=timezone.now())
+
+        self.assertEqual(self.sync(), 'up_to_date')
+        task.delay.assert_not_called()
+        self.assertIsNone(cache.get(STATS_SYNC_LOCK_KEY.format(self.connection.id)))
+
+    @mock.patch('transfer.tasks.SpotifyMusicAnalysisService')
+    def test_task_releases_lock_even_on_error(self, analysis):
+        analysis.return_value.create_listening_stats_data.return_value = None
+        with mock.patch('transfer.views.sync_listening_stats_task'):
+            self.assertEqual(self.sync(), 'queued')
+
+        sync_listening_stats_task(self.connection.id)
+
+        self.assertIsNone(cache.get(STATS_SYNC_LOCK_KEY.format(self.connection.id)))
+        self.connection.refresh_from_db()
+        self.assertEqual(self.connection.sync_errors, 'No se pudieron obtener datos')
+        with mock.patch('transfer.views.sync_listening_stats_task'):
+            self.assertEqual(self.sync(), 'queued')
+
+
+# El modelo User actual no tiene youtube_music_browser_data: se fuerza el modo sin autenticación
+@mock.patch.object(YouTubeMusicService, 'is_authenticated', return_value=False)
+@mock.patch('transfer.services.youtube.PROGRESS_BATCH_SIZE', 2)
+class TransferTaskTests(TestCase):
+    """Transferencia completa en el worker con YouTube Music simulado"""
+
+    SONGS = 7
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='transfer_user', password='x')
+        self.playlist = Playlist.objects.create(user=self.user, spotify_id='pl', name='Playlist')
+        for index in range(self.SONGS):
+            song = Song.objects.create(name=f'Track{index}', artist='Artist', spotify_id=f'sp{index}')
+            PlaylistSong.objects.create(playlist=self.playlist, song=song, position=index)
+        self.job = TransferJob.objects.create(user=self.user, playlist=self.playlist, youtube_playlist_name='YT')
+
+        # Una de cada tres canciones no tiene coincidencia
+        def search(query, filter=None, limit=None):
+            name = query.split()[0]
+            if int(name[5:]) % 3 == 0:
+                return []
+            return [{
+                'resultType': 'song',
+                'videoId': f'vid{name[5:]}',
+                'title': name,
+                'artists': [{'name': 'Artist'}]
+            }]
+
+        self.ytmusic = mock.Mock()
+        self.ytmusic.search.side_effect = search
+
+        def initialize(service):
+            service.ytmusic = self.ytmusic
+
+        patcher = mock.patch.object(YouTubeMusicService, '_initialize_ytmusic', autospec=True, side_effect=initialize)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_counts_and_results(self, is_authenticated):
+        with mock.patch.object(YouTubeMusicService, 'add_songs_to_playlist', autospec=True) as add_songs:
+            process_transfer_task(self.job.id)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'partial')
+        self.assertEqual(self.job.total_songs, 7)
+        self.assertEqual(self.job.processed_songs, 7)
+        self.assertEqual(self.job.successful_transfers, 4)
+        self.assertEqual(self.job.failed_transfers, 3)
+        self.assertEqual(self.job.progress_percentage, 100)
+        self.assertTrue(self.job.youtube_playlist_id.startswith('PLsim'))
+        self.assertIsNotNone(self.job.completed_at)
+
+        results = {
+            result.song.name: result
+            for result in SongTransferResult.objects.filter(transfer_job=self.job)
+        }
+        self.assertEqual(len(results), 7)
+        self.assertEqual(results['Track1'].transfer_status, 'success')
+        self.assertEqual(results['Track1'].youtube_video_id, 'vid1')
+        self.assertEqual(results['Track3'].transfer_status, 'failed')
+        self.assertEqual(results['Track3'].error_message, 'No se encontró coincidencia en YouTube Music')
+
+        # Los videos se añaden en el orden de la playlist
+        add_songs.assert_called_once()
+        self.assertEqual(add_songs.call_args.args[2], ['vid1', 'vid2', 'vid4', 'vid5'])
+        self.playlist.refresh_from_db()
+        self.assertEqual(self.playlist.youtube_playlist_id, self.job.youtube_playlist_id)
+
+    def test_no_matches_fails_job(self, is_authenticated):
+        self.ytmusic.search.side_effect = None
+        self.ytmusic.search.return_value = []
+
+        process_transfer_task(self.job.id)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'failed')
+        self.assertEqual(self.job.failed_transfers, 7)
+        self.assertEqual(self.job.error_message, 'No se pudo transferir ninguna canción')
+
+    def test_claimed_job_is_not_transferred_again(self, is_authenticated):
+        process_transfer_task(self.job.id)
+        process_transfer_task(self.job.id)
+
+        self.assertEqual(SongTransferResult.objects.filter(transfer_job=self.job).count(), 7)
+        self.assertEqual(self.ytmusic.search.call_count, 7)
+
+
+class SpotifyImportTests(TestCase):
+    """Importación de una playlist de Spotify paginada con spotipy simulado"""
+
+    ARTISTS = [{'name': 'Artist A'}, {'name': 'Artist B'}]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='import_user', password='x')
+        # Atributos de sesión de Spotify que handle_callback deja en la instancia
+        self.user.has_spotify_connected = True
+        self.user.spotify_access_token = 'access'
+        self.user.spotify_token_expires_at = None
+
+        # 120 canciones (las 10 últimas repiten las primeras), más un hueco
+        # borrado y un episodio de podcast que no se importan
+        items = [{'track': self.track(index % 110)} for index in range(120)]
+        items.insert(5, {'track': None})
+        items.insert(50, {'track': dict(self.track(999), type='episode')})
+        self.items = items
+
+        self.sp = mock.Mock()
+        self.sp.playlist.return_value = {'name': 'Mix', 'description': 'desc'}
+        self.sp.playlist_tracks.side_effect = lambda playlist_id, fields=None, limit=100, offset=0: {
+            'total': len(items),
+            'items': items[offset:offset + limit]
+        }
+        patcher = mock.patch('transfer.services.spotify._spotify_client', return_value=self.sp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def track(self, index):
+        return {
+            'id': f'id{index}',
+            'name': f'Song{index}',
+            'type': 'track',
+            'duration_ms': 1000 + index,
+            'preview_url': None,
+            'external_urls': {'spotify': f'https://open.spotify.com/track/id{index}'},
+            'artists': self.ARTISTS,
+            'album': {'name': 'Album'}
+        }
+
+    def test_import_keeps_order_and_dedups_songs(self):
+        existing = Song.objects.create(name='Song3', artist='Artist A, Artist B')
+
+        playlist = SpotifyPlaylistService(self.user).import_playlist('pl1')
+
+        self.assertEqual(playlist.name, 'Mix')
+        self.assertEqual(playlist.total_tracks, 120)
+        self.assertEqual(self.sp.playlist_tracks.call_count, 2)
+        self.assertEqual(Song.objects.count(), 110)
+
+        positions = list(
+            PlaylistSong.objects.filter(playlist=playlist).order_by('position').values_list('position', 'song__name')
+        )
+        self.assertEqual(positions, [(index + 1, f'Song{index % 110}') for index in range(120)])
+
+        existing.refresh_from_db()
+        self.assertEqual(existing.spotify_id, 'id3')
+        self.assertEqual(existing.spotify_url, 'https://open.spotify.com/track/id3')
+        self.assertEqual(Song.objects.get(name='Song42').duration_ms, 1042)
+
+    def test_import_twice_is_rejected(self):
+        service = SpotifyPlaylistService(self.user)
+        service.import_playlist('pl1')
+
+        with self.assertRaisesMessage(Exception, 'Esta playlist ya ha sido importada'):
+            service.import_playlist('pl1')
+        self.assertEqual(PlaylistSong.objects.count(), 120)
+
+
+def top(name, minutes):
+    """Elemento de un top tal como lo devuelven las estadísticas unificadas"""
+    return {'name': name, 'name_lc': name.lower(), 'minutes': minutes}
+
+
+def baseline_compatibility(stats1, stats2):
+    """Fórmula original: Jaccard sobre nombres en minúsculas y compartidos ordenados por minutos"""
+    def jaccard(list1, list2):
+        if not list1 or not list2:
+            return 0.0
+        set1 = {item['name'].lower() for item in list1}
+        set2 = {item['name'].lower() for item in list2}
+        return len(set1 & set2) / len(set1 | set2) * 100
+
+    def shared(list1, list2):
+        items2 = {item['name'].lower(): item for item in list2}
+        items = [
+            {
+                'name': item['name'],
+                'user1_minutes': item.get('minutes', 0),
+                'user2_minutes': items2[item['name'].lower()].get('minutes', 0)
+            }
+            for item in list1 if item['name'].lower() in items2
+        ]
+        items.sort(key=lambda x: x['user1_minutes'] + x['user2_minutes'], reverse=True)
+        return items[:10]
+
+    artists = jaccard(stats1['top_artists'], stats2['top_artists'])
+    genres = jaccard(stats1['top_genres'], stats2['top_genres'])
+    return {
+        'overall_compatibility': round(artists * 0.6 + genres * 0.4, 1),
+        'artist_compatibility': round(artists, 1),
+        'genre_compatibility': round(genres, 1),
+        'shared_artists': shared(stats1['top_artists'], stats2['top_artists']),
+        'shared_genres': shared(stats1['top_genres'], stats2['top_genres'])
+    }
+
+
+class MusicCompatibilityTests(TestCase):
+    """Compatibilidad entre usuarios frente a la fórmula original y caché de estadísticas"""
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='x')
+        self.user2 = User.objects.create_user(username='user2', password='x')
+        # 12 artistas compartidos (más de los 10 que se devuelven), con mayúsculas distintas
+        self.stats = {
+            self.user1.pk: {
+                'top_artists': [top(f'Artist{index}', 100 - index) for index in range(15)] + [top('Solo', 5)],
+                'top_genres': [top('pop', 50), top('Rock', 40), top('indie', 10)]
+            },
+            self.user2.pk: {
+                'top_artists': [top(f'artist{index}', index * 3) for index in range(3, 18)],
+                'top_genres': [top('rock', 30), top('jazz', 20)]
+            }
+        }
+        patcher = mock.patch.object(
+            MusicAnalysisService, '_build_unified_stats', autospec=True,
+            side_effect=lambda service, period: self.stats[service.user.pk]
+        )
+        self.build = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_matches_baseline_formula(self):
+        result = MusicAnalysisService(self.user1).calculate_music_compatibility(self.user2)
+        expected = baseline_compatibility(self.stats[self.user1.pk], self.stats[self.user2.pk])
+
+        level = result.pop('compatibility_level')
+        self.assertEqual(result, expected)
+        self.assertEqual(result['artist_compatibility'], 63.2)
+        self.assertEqual(result['genre_compatibility'], 25.0)
+        self.assertEqual(
+            [item['name'] for item in result['shared_artists']],
+            [f'Artist{index}' for index in range(14, 4, -1)]
+        )
+        self.assertEqual(level['level'], 'Algo en Común')
+
+    def test_disjoint_users_match_baseline(self):
+        self.stats[self.user2.pk] = {'top_artists': [top('Other', 10)], 'top_genres': [top('metal', 10)]}
+
+        result = MusicAnalysisService(self.user1).calculate_music_compatibility(self.user2)
+        expected = baseline_compatibility(self.stats[self.user1.pk], self.stats[self.user2.pk])
+
+        result.pop('compatibility_level')
+        self.assertEqual(result, expected)
+        self.assertEqual(result['overall_compatibility'], 0.0)
+
+    def test_unified_stats_cached_until_next_sync(self):
+        service = MusicAnalysisService(self.user1)
+        service.get_unified_stats()
+        service.get_unified_stats()
+        MusicAnalysisService(self.user1).get_unified_stats()
+        self.assertEqual(self.build.call_count, 1)
 
-# Create your tests here.
+        self.user1.mark_music_synced()
+        MusicAnalysisService(self.user1).get_unified_stats()
+        self.assertEqual(self.build.call_count, 2)
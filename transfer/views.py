@@ -8,8 +8,10 @@ from django.db import transaction
 from django.db import models
 from django.contrib.auth import authenticate, login, get_user_model
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
+from itertools import chain
 import logging
 
 from .models import Playlist, Song, TransferJob, PlaylistSong, SongTransferResult
@@ -19,21 +21,43 @@ from .serializers import (
     SongSerializer, UserRegistrationSerializer, UserProfileSerializer, UserSerializer
 )
 from .services.spotify import SpotifyAuthService, SpotifyPlaylistService
-from .services.youtube import YouTubeTransferService, PlaylistExportService
+from .services.youtube import PlaylistExportService
 from .services.google_auth import GoogleOAuthService, YouTubeMusicService
+from .tasks import (
+    process_transfer_task, sync_listening_stats_task,
+    STATS_REFRESH_INTERVAL, STATS_SYNC_LOCK_KEY, STATS_SYNC_LOCK_TIMEOUT
+)
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
+def _enqueue_transfer(transfer_job):
+    """Encola la transferencia; si el broker falla, el trabajo se marca fallido y no bloquea otros"""
+    try:
+        process_transfer_task.delay(transfer_job.id)
+    except Exception as e:
+        logger.error(f"No se pudo encolar la transferencia {transfer_job.id}: {e}")
+        fields = {
+            'status': 'failed',
+            'error_message': 'No se pudo encolar la transferencia. Inténtalo de nuevo más tarde.',
+            'completed_at': timezone.now()
+        }
+        TransferJob.objects.filter(id=transfer_job.id, status='pending').update(**fields)
+        for field, value in fields.items():
+            setattr(transfer_job, field, value)
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register(request):
     """Registro de nuevos usuarios"""
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
-        user = serializer.save()
-        token, created = Token.objects.get_or_create(user=user)
+        # Usuario y token se crean juntos o no se crea ninguno
+        with transaction.atomic():
+            user = serializer.save()
+            token = Token.objects.create(user=user)
         return Response({
             'user': UserSerializer(user).data,
             'token': token.key,
@@ -100,12 +124,14 @@ class PlaylistViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Playlist.objects.filter(user=self.request.user)
+        queryset = Playlist.objects.filter(user=self.request.user)
+        return self.get_serializer_class().setup_eager_loading(queryset)
     
     def get_serializer_class(self):
-        if self.action == 'list':
-            return PlaylistListSerializer
-        return PlaylistSerializer
+        # Las canciones solo se serializan (y precargan) con ?include=songs o al escribir
+        if self.request.query_params.get('include') == 'songs' or self.action in ('create', 'update', 'partial_update'):
+            return PlaylistSerializer
+        return PlaylistListSerializer
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -148,16 +174,17 @@ class PlaylistViewSet(viewsets.ModelViewSet):
         playlist = self.get_object()
         try:
             export_service = PlaylistExportService(request.user)
-            csv_content = export_service.export_to_csv(playlist)
+            rows = export_service.iter_csv_rows(playlist)
             
-            # Crear respuesta HTTP con CSV y encoding UTF-8 BOM para Excel
-            response = HttpResponse(content_type='text/csv; charset=utf-8-sig')
+            # El CSV se envía por partes a medida que se genera; el BOM va
+            # solo al principio para que Excel reconozca UTF-8 (utf-8-sig lo
+            # repetiría en cada parte)
+            response = StreamingHttpResponse(
+                chain(('\ufeff',), rows),
+                content_type='text/csv; charset=utf-8'
+            )
             response['Content-Disposition'] = f'attachment; filename="{playlist.name}_playlist.csv"'
             
-            # Agregar BOM para que Excel reconozca UTF-8
-            response.write('\ufeff')  # BOM
-            response.write(csv_content)
-            
             return response
             
         except Exception as e:
@@ -208,7 +235,10 @@ class TransferJobViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return TransferJob.objects.filter(user=self.request.user)
+        queryset = TransferJob.objects.filter(user=self.request.user)
+        if self.action in ('list', 'progress'):
+            return TransferJobListSerializer.setup_eager_loading(queryset)
+        return TransferJobSerializer.setup_eager_loading(queryset)
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -254,25 +284,13 @@ class TransferJobViewSet(viewsets.ModelViewSet):
                         total_songs=playlist.total_tracks
                     )
                     
-                    # Iniciar la transferencia usando el servicio de YouTube
-                    try:
-                        youtube_service = YouTubeTransferService(request.user)
-                        result = youtube_service.transfer_playlist(playlist, transfer_job)
-                        
-                        return Response(
-                            TransferJobSerializer(transfer_job).data,
-                            status=status.HTTP_201_CREATED
-                        )
-                    except Exception as transfer_error:
-                        # Si falla la transferencia, marcar como fallido
-                        transfer_job.status = 'failed'
-                        transfer_job.error_message = str(transfer_error)
-                        transfer_job.save()
-                        
-                        return Response(
-                            {'error': f'Error en transferencia: {str(transfer_error)}'},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                        )
+                    # Encolar la transferencia para un worker de Celery una vez confirmado el trabajo
+                    transaction.on_commit(lambda: _enqueue_transfer(transfer_job))
+                
+                return Response(
+                    TransferJobSerializer(transfer_job).data,
+                    status=status.HTTP_201_CREATED
+                )
                     
             except Exception as e:
                 return Response(
@@ -499,10 +517,15 @@ def spotify_auth_or_register(request):
             # Usuario nuevo: crear cuenta
             username = f"spotify_{spotify_user_id}"
             
-            # Verificar si el username ya existe (por si acaso)
+            # Verificar si el username ya existe (por si acaso); los ocupados se leen
+            # en una sola consulta y sin distinguir mayúsculas, como la collation de MySQL
             counter = 1
             original_username = username
-            while User.objects.filter(username=username).exists():
+            taken = {
+                name.casefold()
+                for name in User.objects.filter(username__istartswith=original_username).values_list('username', flat=True)
+            }
+            while username.casefold() in taken:
                 username = f"{original_username}_{counter}"
                 counter += 1
             
@@ -713,8 +736,8 @@ def youtube_music_test_connection(request):
         
         # Intentar hacer una búsqueda simple para probar la conexión
         try:
-            # Intentar una búsqueda básica
-            test_result = youtube_service.search_track("Never Gonna Give You Up", "Rick Astley")
+            # Búsqueda básica sin caché: debe llegar de verdad a YouTube Music
+            test_result = youtube_service.search_track("Never Gonna Give You Up", "Rick Astley", use_cache=False)
             
             if test_result:
                 return Response({
@@ -1077,7 +1100,12 @@ def disconnect_platform(request, platform_name):
         connection.save()
         
         # Limpiar datos relacionados
-        request.user.listening_stats.filter(platform_connection=connection).delete()
+        with transaction.atomic():
+            stats = request.user.listening_stats.filter(platform_connection=connection)
+            removed_minutes = stats.aggregate(total=models.Sum('total_minutes'))['total'] or 0
+            stats.delete()
+            request.user.add_listening_minutes(-removed_minutes)
+        request.user.mark_music_synced()
         
         return Response({
             'message': f'Desconectado de {platform.display_name} exitosamente'
@@ -1159,68 +1187,44 @@ def music_stats(request):
 def sync_music_data(request):
     """Sincronizar datos musicales de todas las plataformas conectadas"""
     try:
-        from .models import UserListeningStats
-        from .services.spotify_analysis import SpotifyMusicAnalysisService
-        
         synced_platforms = []
         errors = []
         
         # Obtener conexiones activas
-        connections = request.user.music_connections.filter(is_active=True)
+        connections = request.user.music_connections.filter(is_active=True).select_related('platform')
         
         for connection in connections:
-            try:
-                if connection.platform.name == 'spotify':
-                    # Sincronizar Spotify
-                    if connection.access_token:
-                        spotify_service = SpotifyMusicAnalysisService(connection.access_token)
-                        stats_data = spotify_service.create_listening_stats_data(connection)
-                        
-                        if stats_data:
-                            # Crear o actualizar estadísticas
-                            stats, created = UserListeningStats.objects.update_or_create(
-                                user=request.user,
-                                platform_connection=connection,
-                                period_type=stats_data['period_type'],
-                                period_start=stats_data['period_start'],
-                                defaults=stats_data
-                            )
-                            
-                            synced_platforms.append({
-                                'platform': connection.platform.display_name,
-                                'status': 'success',
-                                'tracks': stats_data['total_tracks'],
-                                'minutes': stats_data['total_minutes']
-                            })
-                            
-                            # Actualizar fecha de sincronización
-                            connection.last_synced = timezone.now()
-                            connection.sync_errors = ''
-                            connection.save()
-                        else:
-                            errors.append(f"{connection.platform.display_name}: No se pudieron obtener datos")
-                    else:
-                        errors.append(f"{connection.platform.display_name}: Token de acceso no válido")
+            if connection.platform.name == 'spotify':
+                if not connection.access_token:
+                    errors.append(f"{connection.platform.display_name}: Token de acceso no válido")
+                    continue
                 
-                # Agregar otras plataformas aquí en el futuro
+                # Las llamadas a Spotify se hacen en un worker; aquí solo se encola
+                if connection.last_synced and timezone.now() - connection.last_synced < STATS_REFRESH_INTERVAL:
+                    sync_status = 'up_to_date'
+                elif cache.add(STATS_SYNC_LOCK_KEY.format(connection.id), True, STATS_SYNC_LOCK_TIMEOUT):
+                    transaction.on_commit(lambda cid=connection.id: sync_listening_stats_task.delay(cid))
+                    sync_status = 'queued'
                 else:
-                    errors.append(f"{connection.platform.display_name}: Sincronización no implementada aún")
-                    
-            except Exception as e:
-                error_msg = f"{connection.platform.display_name}: {str(e)}"
-                errors.append(error_msg)
+                    sync_status = 'in_progress'
                 
-                # Guardar error en la conexión
-                connection.sync_errors = str(e)
-                connection.save()
+                synced_platforms.append({
+                    'platform': connection.platform.display_name,
+                    'status': sync_status,
+                    'last_synced': connection.last_synced
+                })
+            
+            # Agregar otras plataformas aquí en el futuro
+            else:
+                errors.append(f"{connection.platform.display_name}: Sincronización no implementada aún")
         
         return Response({
-            'message': 'Sincronización completada',
+            'message': 'Sincronización en curso',
             'synced_platforms': synced_platforms,
             'errors': errors,
             'total_platforms': len(connections),
             'successful_syncs': len(synced_platforms)
-        })
+        }, status=status.HTTP_202_ACCEPTED)
         
     except Exception as e:
         return Response({
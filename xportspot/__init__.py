@@ -1,3 +1,6 @@
 import pymysql
 pymysql.install_as_MySQLdb()
 
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
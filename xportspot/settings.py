@@ -68,6 +68,10 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'transfer.renderers.OrjsonRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 # Configuración de CORS (para desarrollo)
@@ -169,3 +173,30 @@ GOOGLE_OAUTH_REDIRECT_URI = config('GOOGLE_OAUTH_REDIRECT_URI', default='http://
 # URLs del proyecto
 FRONTEND_URL = config('FRONTEND_URL', default='http://127.0.0.1:3000')
 BACKEND_URL = config('BACKEND_URL', default='http://127.0.0.1:8000')
+
+# Caché de búsquedas, análisis y locks de sincronización. Con workers de
+# Celery debe ser compartida entre procesos: definir CACHE_URL (Redis, p. ej.
+# redis://localhost:6379/1). Sin CACHE_URL se usa memoria local del proceso.
+CACHE_URL = config('CACHE_URL', default='')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Configuración de Celery (transferencias en segundo plano)
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Pocas transferencias simultáneas para respetar los límites de YouTube Music
+CELERY_WORKER_CONCURRENCY = config('CELERY_WORKER_CONCURRENCY', default=2, cast=int)
+# Búsquedas simultáneas por transferencia (bajar si YouTube Music devuelve 429)
+YTMUSIC_SEARCH_WORKERS = config('YTMUSIC_SEARCH_WORKERS', default=8, cast=int)